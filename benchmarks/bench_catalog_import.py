@@ -0,0 +1,135 @@
+# Bulk catalog import from an admin upload, and how long it stalls the bot.
+#
+#   python benchmarks/bench_catalog_import.py [products]
+#
+# Generates CSV and JSON documents with Amazon-length links and imports
+# them into an empty database (every row new), then re-uploads them with
+# 1% of the stock changed. Each import runs the way import_catalog does
+# it: parsing on a worker thread, the upsert through CatalogReloader.apply
+# (db.upsert_products). A ticker coroutine records the
+# longest event-loop stall, i.e. how long a buyer's update could wait,
+# next to the same import run inline on the loop.
+
+import os
+import io
+import sys
+import csv
+import json
+import time
+import random
+import shutil
+import asyncio
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+# Real product links pasted from the browser are ~300 bytes
+LINK_TAIL = "/ref=sr_1_1?crid=3U6JBCCH65OET&dib=" + "x" * 220
+
+def make_items():
+    return [
+        {"name": f"Product {i}", "link": f"https://www.amazon.com/Product-{i}/dp/B{i:09d}{LINK_TAIL}", "stock": random.randint(0, 50)}
+        for i in range(PRODUCTS)
+    ]
+
+def make_document(items, fmt):
+    if fmt == "json":
+        return json.dumps(items, ensure_ascii=False).encode("utf-8")
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(["name", "link", "stock"])
+    writer.writerows([item["name"], item["link"], item["stock"]] for item in items)
+    return text.getvalue().encode("utf-8")
+
+class StallMeter:
+    # Longest gap between 1 ms ticks while running
+    def __init__(self):
+        self.worst = 0.0
+        self._task = None
+
+    async def _tick(self):
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            self.worst = max(self.worst, now - last - 0.001)
+            last = now
+
+    async def __aenter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        # Let the ticker start before the measured work does
+        await asyncio.sleep(0.01)
+        return self
+
+    async def __aexit__(self, *exc):
+        # One more tick to see a stall that ended just now
+        await asyncio.sleep(0.002)
+        self._task.cancel()
+
+async def offloaded(reloader, catalog, data, fmt, parse):
+    # What import_catalog does
+    products, errors = await asyncio.to_thread(parse, data, fmt)
+    await reloader.apply(catalog, products)
+    return len(errors)
+
+async def inline(reloader, catalog, data, fmt, parse, db):
+    # The same work without leaving the event loop
+    products, errors = parse(data, fmt)
+    db.upsert_products(products)
+    catalog.sync(db.get_all_products())
+    return len(errors)
+
+async def run(reloader, catalog, data, fmt, parse, mode, db):
+    async with StallMeter() as meter:
+        started = time.perf_counter()
+        if mode == "off loop":
+            errors = await offloaded(reloader, catalog, data, fmt, parse)
+        else:
+            errors = await inline(reloader, catalog, data, fmt, parse, db)
+        total = time.perf_counter() - started
+    assert errors == 0 and len(catalog) == PRODUCTS
+    return total * 1000, meter.worst * 1000
+
+def clear(db):
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM products")
+
+async def main():
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(tmp, "orders.db")
+    import db
+    from catalog import Catalog
+    from catalog_reload import CatalogReloader
+    from catalog_io import parse_products_document
+    db.init_db()
+    reloader = CatalogReloader(os.path.join(tmp, "products.json"))
+    items = make_items()
+    try:
+        for fmt in ("csv", "json"):
+            data = make_document(items, fmt)
+            print(f"\n{PRODUCTS} products, {fmt.upper()} {len(data) / 1e6:.1f} MB")
+            started = time.perf_counter()
+            parse_products_document(data, fmt)
+            print(f"{'parse + validate':<24}{(time.perf_counter() - started) * 1000:>10.1f} ms")
+            print(f"{'':<24}{'total, ms':>13}{'worst stall, ms':>18}")
+            for mode in ("inline", "off loop"):
+                clear(db)
+                catalog = Catalog()
+                total, stall = await run(reloader, catalog, data, fmt, parse_products_document, mode, db)
+                print(f"{'new, ' + mode:<24}{total:>13.1f}{stall:>18.1f}")
+
+            # Re-upload with 1% changed: only those rows are written and synced
+            for item in random.sample(items, PRODUCTS // 100):
+                item["stock"] += 5
+            data = make_document(items, fmt)
+            for mode in ("inline", "off loop"):
+                total, stall = await run(reloader, catalog, data, fmt, parse_products_document, mode, db)
+                print(f"{'1% changed, ' + mode:<24}{total:>13.1f}{stall:>18.1f}")
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    asyncio.run(main())
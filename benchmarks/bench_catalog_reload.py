@@ -0,0 +1,68 @@
+# Time to hot-reload products.json into the database and the catalog.
+#
+#   python benchmarks/bench_catalog_reload.py [products]
+#
+# Loads a generated catalog once, then reloads it after changing the
+# stock of 1% of the products, split into the stages CatalogReloader runs:
+# parsing and validation (worker thread), the database upsert (DB
+# executor) and Catalog.sync (event loop, the only part handlers wait for).
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+def write_catalog(path, items):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(items, f, ensure_ascii=False)
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - started) * 1000
+
+def main():
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(tmp, "orders.db")
+    import db
+    from catalog import Catalog
+    from catalog_reload import read_products_file
+    db.init_db()
+    path = os.path.join(tmp, "products.json")
+    items = [
+        {"name": f"Product {i}", "link": f"https://www.amazon.com/dp/B{i:09d}", "stock": random.randint(0, 50)}
+        for i in range(PRODUCTS)
+    ]
+    try:
+        write_catalog(path, items)
+        products, _ = read_products_file(path)
+        db.apply_products_file(products)
+        catalog = Catalog(db.get_all_products())
+
+        for item in random.sample(items, PRODUCTS // 100):
+            item["stock"] += 5
+        write_catalog(path, items)
+
+        print(f"\nReload of {PRODUCTS} products ({os.path.getsize(path) / 1e6:.1f} MB), 1% changed")
+        (products, errors), parse_ms = timed(read_products_file, path)
+        (added, updated, _), apply_ms = timed(db.apply_products_file, products)
+        rows, load_ms = timed(db.get_all_products)
+        changed, sync_ms = timed(catalog.sync, rows)
+        print(f"{'parse + validate':<22}{parse_ms:>9.1f} ms  (worker thread)")
+        print(f"{'database upsert':<22}{apply_ms:>9.1f} ms  (DB executor, {updated} updated)")
+        print(f"{'read back':<22}{load_ms:>9.1f} ms  (DB executor)")
+        print(f"{'Catalog.sync':<22}{sync_ms:>9.1f} ms  (event loop, {changed} changed)")
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Order-flow dispatch cost as the flow grows.
+#
+#   python benchmarks/bench_flow.py [updates]
+#
+# Builds FlowEngine tables with 10 to 10 000 generated text steps and
+# times dispatching updates to the last state, i.e. the step an if-chain
+# over the session fields would reach last.
+
+import os
+import sys
+import time
+import asyncio
+from enum import Enum
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flow import FlowEngine, Step, Event
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+class FakeMessage:
+    async def reply_text(self, text):
+        pass
+
+class FakeUpdate:
+    effective_message = FakeMessage()
+
+class FakeSession:
+    __slots__ = ("state", "state_at")
+
+    def __init__(self, state):
+        self.state = state
+        self.state_at = None
+
+async def answer(update, context, session, value):
+    pass
+
+async def measure(steps):
+    states = Enum("States", [f"STEP_{i}" for i in range(steps)])
+    engine = FlowEngine({(state, Event.TEXT): Step(answer) for state in states})
+    session = FakeSession(list(states)[-1])
+    update = FakeUpdate()
+    started = time.perf_counter()
+    for _ in range(UPDATES):
+        await engine.dispatch(update, None, session, Event.TEXT, "text")
+    return (time.perf_counter() - started) / UPDATES
+
+async def main():
+    print(f"{'steps':>8}{'µs/update':>12}")
+    for steps in (10, 100, 1000, 10000):
+        print(f"{steps:>8}{await measure(steps) * 1e6:>12.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
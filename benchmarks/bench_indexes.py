@@ -0,0 +1,102 @@
+# Before/after timing of the hot order queries on a synthetic orders.db.
+#
+#   python benchmarks/bench_indexes.py [rows]
+#
+# Builds a throwaway database (1M rows by default) with only the original
+# orders table, times the queries, applies the remaining migrations and
+# times them again.
+
+import os
+import sys
+import time
+import random
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import MIGRATIONS, migrate
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+USERS = 50_000
+PRODUCTS = [f"Product {i}" for i in range(200)]
+REPEATS = 200
+
+QUERIES = {
+    "get_user_orders": ("""
+        SELECT id, product_name, quantity, created_at
+        FROM orders WHERE user_id=? ORDER BY created_at DESC
+    """, True),
+    "latest_pending_order": ("""
+        SELECT id FROM orders
+        WHERE user_id=? AND review_sent=0
+        ORDER BY created_at DESC LIMIT 1
+    """, True),
+    "orders_pending_review": ("SELECT id, user_id, product_name FROM orders WHERE review_sent=0", False),
+    "all_orders_first_page": ("SELECT * FROM orders ORDER BY created_at DESC LIMIT 100", False),
+}
+
+def build(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    # Only the base table, so the "before" numbers match the old schema
+    conn.execute("BEGIN")
+    MIGRATIONS[0][2](conn)
+    conn.execute(f"PRAGMA user_version = {MIGRATIONS[0][0]}")
+    conn.commit()
+
+    rnd = random.Random(42)
+    start = 1_700_000_000
+    def rows():
+        for i in range(ROWS):
+            yield (
+                rnd.randrange(USERS),
+                rnd.choice(PRODUCTS),
+                "https://www.amazon.com/dp/B000000000",
+                rnd.randint(1, 3),
+                "Customer",
+                f"111-{i:07d}",
+                # ~2% of orders are still waiting for a review screenshot
+                0 if rnd.random() < 0.02 else 1,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(start + i * 30)),
+            )
+    conn.executemany("""
+        INSERT INTO orders
+        (user_id, product_name, product_link, quantity, customer_name, order_number, review_sent, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, rows())
+    conn.commit()
+    return conn
+
+def run(conn):
+    rnd = random.Random(7)
+    results = {}
+    for name, (sql, per_user) in QUERIES.items():
+        repeats = REPEATS if per_user else 5
+        began = time.perf_counter()
+        for _ in range(repeats):
+            params = (rnd.randrange(USERS),) if per_user else ()
+            conn.execute(sql, params).fetchall()
+        results[name] = (time.perf_counter() - began) / repeats * 1000
+    return results
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "orders.db")
+        print(f"Заполняем {ROWS} заказов...")
+        conn = build(path)
+        before = run(conn)
+
+        began = time.perf_counter()
+        migrate(conn)
+        print(f"Миграции заняли {time.perf_counter() - began:.1f} с")
+        after = run(conn)
+        conn.close()
+
+    print(f"\n{'query':<24}{'before, ms':>12}{'after, ms':>12}{'speedup':>10}")
+    for name in QUERIES:
+        print(f"{name:<24}{before[name]:>12.3f}{after[name]:>12.3f}{before[name] / after[name]:>9.0f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# Size of orders.db, the /allorders export and the product message before
+# and after links are normalized (migration 13, see links.py).
+#
+#   python benchmarks/bench_links.py [orders]
+#
+# Builds a database at schema version 12 whose products and orders carry
+# links shaped like the ones in products.json (Amazon search URLs), then
+# applies migration 13 and VACUUMs so the file sizes are comparable.
+
+import io
+import os
+import csv
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+PRODUCTS = 200
+
+def search_link(i, rnd):
+    # ~1 KB, like the links pasted from search results into products.json
+    token = "".join(rnd.choice("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_") for _ in range(300))
+    keywords = "%2B".join(f"word{rnd.randrange(1000)}" for _ in range(40))
+    return (
+        f"https://www.amazon.com/Product-Name-{i}/dp/B0{i:08d}/ref=sr_1_1?crid=3U6JBCCH65OET"
+        f"&dib=eyJ2IjoiMSJ9.{token}&dib_tag=se&keywords={keywords}&qid=1771970779&sr=8-1&th=1"
+    )
+
+def build(db, migrations):
+    rnd = random.Random(42)
+    links = [search_link(i, rnd) for i in range(PRODUCTS)]
+    # Stop at version 12: the schema before links were normalized
+    full = migrations.MIGRATIONS
+    migrations.MIGRATIONS = [m for m in full if m[0] <= 12]
+    try:
+        db.init_db()
+    finally:
+        migrations.MIGRATIONS = full
+    with db.get_connection() as conn:
+        conn.executemany(
+            "INSERT INTO products (name, link, stock) VALUES (?, ?, 1000)",
+            [(f"Product {i}", links[i]) for i in range(PRODUCTS)],
+        )
+        rows = []
+        for n in range(ORDERS):
+            i = rnd.randrange(PRODUCTS)
+            rows.append((rnd.randrange(10_000), f"Product {i}", links[i], rnd.randint(1, 3), "Customer", f"111-{n:07d}"))
+        conn.executemany("""
+            INSERT INTO orders (user_id, product_name, product_link, quantity, customer_name, order_number)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, rows)
+    return links
+
+# The /allorders query before migration 13, for the "before" export
+OLD_EXPORT_QUERY = """
+    SELECT id, user_id, product_name, product_link, quantity, customer_name, order_number,
+           payment_method, payment_info, review_sent, created_at
+    FROM orders ORDER BY created_at DESC
+"""
+
+def old_export(db, export):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(export.CSV_HEADER)
+    with db.get_connection() as conn:
+        for order in conn.execute(OLD_EXPORT_QUERY):
+            writer.writerow(export.format_order_row(order))
+    return len(text.getvalue().encode("utf-8"))
+
+def new_export(db, export):
+    result = export.export_orders_csv()
+    size = len(result.buffer.read())
+    result.close()
+    return size
+
+def measure(db, export, export_fn):
+    with db.get_connection() as conn:
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    started = time.perf_counter()
+    size = export_fn(db, export)
+    export_ms = (time.perf_counter() - started) * 1000
+    return os.path.getsize(db.DB_NAME), size, export_ms
+
+def main():
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(tmp, "orders.db")
+    import db
+    import export
+    import migrations
+    from links import canonical_link
+    try:
+        links = build(db, migrations)
+        before = measure(db, export, old_export)
+
+        started = time.perf_counter()
+        with db.get_connection() as conn:
+            migrations.migrate(conn)
+        migrate_ms = (time.perf_counter() - started) * 1000
+        after = measure(db, export, new_export)
+
+        message = "🔗 Ссылка на товар:\n{}\n\nВы выбрали: Product 1\nВведите количество:"
+        message_before = len(message.format(links[1]).encode("utf-8"))
+        message_after = len(message.format(canonical_link(links[1])).encode("utf-8"))
+
+        print(f"\n{ORDERS} orders, {PRODUCTS} products; migration 13 took {migrate_ms:.0f} ms")
+        print(f"{'':<22}{'before':>12}{'after':>12}")
+        print(f"{'orders.db, MB':<22}{before[0] / 1e6:>12.1f}{after[0] / 1e6:>12.1f}")
+        print(f"{'/allorders CSV, MB':<22}{before[1] / 1e6:>12.1f}{after[1] / 1e6:>12.1f}")
+        print(f"{'/allorders, ms':<22}{before[2]:>12.0f}{after[2]:>12.0f}")
+        print(f"{'product message, B':<22}{message_before:>12}{message_after:>12}")
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Bot API calls and wall time per completed order against the fake Bot API.
+#
+#   python benchmarks/bench_order_flow.py [buyers] [simulated_rtt_ms]
+#
+# Every buyer walks the whole order flow (/start, product, quantity, name,
+# Amazon order number, payment method, payment details) concurrently with
+# the others; each step waits for the bot's answer like a person would.
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import statistics
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram
+
+BUYERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+RTT = (float(sys.argv[2]) if len(sys.argv) > 2 else 20.0) / 1000
+
+# (how the buyer acts, text that marks the bot's answer to it)
+def steps(keyboards, product_id, user_id):
+    return [
+        ("text", "/start", "Выберите ваш заказ"),
+        ("callback", keyboards.product_callback(product_id), "Введите количество"),
+        ("text", "1", "полное имя"),
+        ("text", f"Buyer {user_id}", "номер заказа"),
+        ("text", f"111-{user_id:07d}", "получить оплату"),
+        ("callback", "zelle", "данные для оплаты"),
+        ("text", f"@buyer{user_id}", "скриншот"),
+    ]
+
+async def main():
+    tmp = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "products.json"), tmp)
+    os.chdir(tmp)
+
+    fake = FakeTelegram(latency=RTT / 2)
+    api_port = await fake.start()
+    os.environ.update({
+        "BOT_TOKEN": "123:fake",
+        "BOT_API_URL": f"http://127.0.0.1:{api_port}",
+        "DB_NAME": os.path.join(tmp, "orders.db"),
+    })
+    import db
+    import bot
+    import keyboards
+    bot.startup()
+    with db.get_connection() as conn:
+        conn.execute("UPDATE products SET stock = 1000000")
+    bot.catalog.sync(db.get_all_products())
+    product_id = bot.catalog.available()[0]["id"]
+
+    waiters = {}
+    def on_call(call):
+        _, method, params = call
+        text = params.get("text") or ""
+        waiter = waiters.get(str(params.get("chat_id")))
+        if waiter and waiter[0] in text and not waiter[1].done():
+            waiter[1].set_result(None)
+    fake.listeners.append(on_call)
+
+    async def buyer(user_id):
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        for kind, value, marker in steps(keyboards, product_id, user_id):
+            future = loop.create_future()
+            waiters[str(user_id)] = (marker, future)
+            if kind == "text":
+                fake.queue_update(fake.make_message_update(user_id, value))
+            else:
+                fake.queue_update(fake.make_callback_update(user_id, value))
+            await asyncio.wait_for(future, 30)
+        return time.perf_counter() - started
+
+    app = bot.build_app()
+    await app.initialize()
+    await app.updater.start_polling(poll_interval=0, timeout=10)
+    await app.start()
+    try:
+        fake.calls.clear()
+        started = time.perf_counter()
+        durations = await asyncio.gather(*(buyer(user_id) for user_id in range(1, BUYERS + 1)))
+        elapsed = time.perf_counter() - started
+        # Let the admin digest and other background sends finish
+        await asyncio.sleep(6)
+        methods = Counter(method for _, method, _ in fake.calls if method != "getUpdates")
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+        await fake.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"\n{BUYERS} concurrent orders, simulated RTT {RTT * 1000:.0f} ms")
+    print(f"API calls per order: {sum(methods.values()) / BUYERS:.2f}")
+    for method, count in methods.most_common():
+        print(f"  {method:<22}{count / BUYERS:>6.2f}")
+    print(f"order flow time: mean {statistics.mean(durations) * 1000:.0f} ms, "
+          f"p95 {sorted(durations)[int(len(durations) * 0.95) - 1] * 1000:.0f} ms")
+    print(f"all orders done in {elapsed:.2f} s")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+# Reply latency while a bulk broadcast is running, against the fake Bot API.
+#
+#   python benchmarks/bench_outbound.py [reminders] [replies] [simulated_rtt_ms]
+#
+# Buyers send /start every 100 ms while the bot sends `reminders` messages
+# to other chats. The fake answers 429 above 30 sends per second, like
+# Telegram. Runs the broadcast at the reminders' own priority and, for
+# comparison, at the same priority as replies (plain FIFO limiting).
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram
+
+REMINDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+REPLIES = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+RTT = (float(sys.argv[3]) if len(sys.argv) > 3 else 20.0) / 1000
+INTERVAL = 0.1
+FIRST_REMINDER_CHAT = 100000
+
+async def reminders(count):
+    for chat_id in range(FIRST_REMINDER_CHAT, FIRST_REMINDER_CHAT + count):
+        yield chat_id, "Здравствуйте! Пожалуйста, пришлите скриншот вашего отзыва ✅"
+
+async def measure_replies(fake, pending, first_user):
+    loop = asyncio.get_running_loop()
+    futures = []
+    for user_id in range(first_user, first_user + REPLIES):
+        future = loop.create_future()
+        pending[user_id] = (time.perf_counter(), future)
+        futures.append(future)
+        fake.queue_update(fake.make_message_update(user_id, "/start"))
+        await asyncio.sleep(INTERVAL)
+    return await asyncio.wait_for(asyncio.gather(*futures), 120)
+
+async def main():
+    tmp = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "products.json"), tmp)
+    os.chdir(tmp)
+
+    fake = FakeTelegram(latency=RTT / 2, flood_limit=30)
+    api_port = await fake.start()
+    os.environ.update({
+        "BOT_TOKEN": "123:fake",
+        "BOT_API_URL": f"http://127.0.0.1:{api_port}",
+        "DB_NAME": os.path.join(tmp, "orders.db"),
+    })
+    import bot
+    from broadcast import Broadcaster
+    from outbound import PRIORITY_INTERACTIVE, PRIORITY_REMINDER
+
+    pending = {}
+    def on_call(call):
+        _, method, params = call
+        entry = pending.pop(int(params.get("chat_id", 0) or 0), None) if method == "sendMessage" else None
+        if entry and not entry[1].done():
+            entry[1].set_result(time.perf_counter() - entry[0])
+    fake.listeners.append(on_call)
+
+    app = bot.build_app()
+    await app.initialize()
+    await app.updater.start_polling(poll_interval=0, timeout=10)
+    await app.start()
+    results = []
+    try:
+        first_user = 1
+        for name, priority in [("replies only", None), ("FIFO (same priority)", PRIORITY_INTERACTIVE), ("reminders below replies", PRIORITY_REMINDER)]:
+            await asyncio.sleep(2)
+            errors = fake.flood_errors
+            broadcast = None
+            if priority is not None:
+                broadcast = asyncio.create_task(Broadcaster(app.bot, priority=priority).run(name, reminders(REMINDERS)))
+                await asyncio.sleep(0.5)
+            latencies = await measure_replies(fake, pending, first_user)
+            first_user += REPLIES
+            stats = await broadcast if broadcast else None
+            results.append((name, latencies, stats, fake.flood_errors - errors))
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+        await fake.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"\n{REPLIES} replies every {INTERVAL * 1000:.0f} ms, {REMINDERS} reminders, simulated RTT {RTT * 1000:.0f} ms")
+    print(f"{'scenario':<26}{'p50, ms':>9}{'p95, ms':>9}{'max, ms':>9}{'bulk msg/s':>12}{'429s':>6}")
+    for name, latencies, stats, errors in results:
+        latencies = sorted(latencies)
+        p95 = latencies[int(len(latencies) * 0.95) - 1]
+        rate = f"{stats.throughput:.1f}" if stats else "—"
+        print(f"{name:<26}{statistics.median(latencies) * 1000:>9.0f}{p95 * 1000:>9.0f}"
+              f"{latencies[-1] * 1000:>9.0f}{rate:>12}{errors:>6}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
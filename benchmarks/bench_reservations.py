@@ -0,0 +1,69 @@
+# Cost of one reaper pass as the number of open checkouts grows.
+#
+#   python benchmarks/bench_reservations.py [expired_per_pass]
+#
+# Fills the reservations table with open holds (expiring later) plus a
+# fixed number of expired ones, then times db.reap_reservations, which
+# walks idx_reservations_expires_at, against the same query forced to
+# scan the table.
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+EXPIRED = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+PRODUCTS = 500
+
+def fill(db, open_holds):
+    now = time.time()
+    with db.get_connection() as conn:
+        conn.execute("DELETE FROM reservations")
+        conn.execute("DELETE FROM products")
+        conn.executemany(
+            "INSERT INTO products (id, name, link, stock) VALUES (?, ?, '', 1000000)",
+            [(i, f"product {i}") for i in range(1, PRODUCTS + 1)],
+        )
+        rows = [(user_id, random.randint(1, PRODUCTS), random.randint(1, 3), now + random.uniform(60, 1800))
+                for user_id in range(open_holds)]
+        rows += [(open_holds + i, random.randint(1, PRODUCTS), 1, now - random.uniform(1, 60))
+                 for i in range(EXPIRED)]
+        conn.executemany("INSERT INTO reservations (user_id, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)", rows)
+
+def scan(db):
+    # What a reaper without the index costs: every hold is looked at
+    with db.get_connection() as conn:
+        return conn.execute(
+            "SELECT id FROM reservations NOT INDEXED WHERE expires_at <= ? ORDER BY expires_at LIMIT 1000",
+            (time.time(),),
+        ).fetchall()
+
+def main():
+    tmp = tempfile.mkdtemp()
+    os.environ["DB_NAME"] = os.path.join(tmp, "orders.db")
+    import db
+    db.init_db()
+    try:
+        print(f"\n{EXPIRED} expired holds per pass")
+        print(f"{'open holds':>12}{'reap, ms':>10}{'scan, ms':>10}{'released':>10}")
+        for open_holds in (1_000, 10_000, 100_000):
+            fill(db, open_holds)
+            started = time.perf_counter()
+            scanned = len(scan(db))
+            scan_ms = (time.perf_counter() - started) * 1000
+            started = time.perf_counter()
+            released, _ = db.reap_reservations()
+            reap_ms = (time.perf_counter() - started) * 1000
+            assert released == scanned == EXPIRED
+            print(f"{open_holds:>12}{reap_ms:>10.2f}{scan_ms:>10.2f}{released:>10}")
+    finally:
+        db.close_pool()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Disk usage and admin browsing cost of review originals vs variants.
+#
+#   python benchmarks/bench_review_variants.py [screenshots] [bandwidth_mbit]
+#
+# Generates phone-sized review screenshots, builds the thumbnail and
+# archive variants with reviews.make_variants (1 process and all cores),
+# then compares the bytes an admin pulls for a page of 10 reviews and the
+# time that takes at the given bandwidth. Needs Pillow.
+
+import os
+import sys
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from PIL import Image, ImageDraw, ImageFilter
+
+import reviews
+from reviews import make_variants, REVIEW_VARIANTS
+
+SCREENSHOTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+BANDWIDTH = (float(sys.argv[2]) if len(sys.argv) > 2 else 20.0) * 1_000_000 / 8
+PAGE = 10
+SIZE = (1179, 2556)
+
+def fake_screenshot(seed):
+    # A review page: header, product photo, star row and lines of text
+    rnd = random.Random(seed)
+    image = Image.new("RGB", SIZE, "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, SIZE[0], 180), fill=(35, 47, 62))
+    photo = Image.effect_noise((700, 700), 60).convert("RGB").filter(ImageFilter.GaussianBlur(3))
+    tint = Image.new("RGB", photo.size, tuple(rnd.randrange(256) for _ in range(3)))
+    image.paste(Image.blend(photo, tint, 0.5), (240, 260))
+    for star in range(5):
+        draw.regular_polygon((120 + star * 90, 1040, 35), 5, fill=(255, 164, 28))
+    y = 1120
+    while y < SIZE[1] - 100:
+        x = 60
+        while x < SIZE[0] - 120:
+            width = rnd.randint(40, 180)
+            draw.rectangle((x, y, x + width, y + 28), fill=(60, 60, 60))
+            x += width + 22
+        y += 58
+    return image
+
+def store(index):
+    image = fake_screenshot(index)
+    part = os.path.join(reviews.REVIEWS_DIR, f"{index}.part")
+    image.save(part, "JPEG", quality=87)
+    with open(part, "rb") as f:
+        sha256 = hashlib.sha256(f.read()).hexdigest()
+    return reviews.store_blob(part, sha256)
+
+def build(relatives, processes):
+    started = time.perf_counter()
+    with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+        results = list(pool.map(make_variants, relatives, [reviews.REVIEWS_DIR] * len(relatives)))
+    return time.perf_counter() - started, results
+
+def page_cost(paths):
+    # Time to read a page from disk plus time to push it to the admin
+    started = time.perf_counter()
+    size = 0
+    for path in paths:
+        with open(os.path.join(reviews.REVIEWS_DIR, path), "rb") as f:
+            size += len(f.read())
+    read = time.perf_counter() - started
+    return size, read, size / BANDWIDTH
+
+def main():
+    tmp = tempfile.mkdtemp()
+    reviews.REVIEWS_DIR = tmp
+    try:
+        relatives = [store(i) for i in range(SCREENSHOTS)]
+
+        timings = []
+        for processes in sorted({1, os.cpu_count() or 1}):
+            elapsed, results = build(relatives, processes)
+            timings.append((processes, elapsed))
+
+        totals = {"original": sum(os.path.getsize(os.path.join(tmp, r)) for r in relatives)}
+        for kind in REVIEW_VARIANTS:
+            totals[kind] = sum(size for variants in results for k, _, size, _, _ in variants if k == kind)
+
+        print(f"\n{SCREENSHOTS} screenshots {SIZE[0]}x{SIZE[1]}, {os.cpu_count()} CPU(s)")
+        print(f"{'processes':<12}{'seconds':>10}{'images/s':>10}")
+        for processes, elapsed in timings:
+            print(f"{processes:<12}{elapsed:>10.2f}{SCREENSHOTS / elapsed:>10.1f}")
+
+        print(f"\n{'kind':<12}{'total MB':>10}{'avg KB':>10}")
+        for kind, total in totals.items():
+            print(f"{kind:<12}{total / 1e6:>10.1f}{total / SCREENSHOTS / 1e3:>10.1f}")
+        kept = totals["thumb"] + totals["archive"]
+        print(f"after eviction: {kept / 1e6:.1f} MB ({kept / totals['original']:.0%} of originals)")
+
+        print(f"\nAdmin page of {PAGE} reviews at {BANDWIDTH * 8 / 1e6:.0f} Mbit/s")
+        print(f"{'kind':<12}{'KB':>10}{'read, ms':>10}{'send, ms':>10}")
+        page = random.Random(1).sample(range(SCREENSHOTS), PAGE)
+        for kind in ["original", *REVIEW_VARIANTS]:
+            paths = [relatives[i] if kind == "original" else reviews.variant_path(relatives[i], kind) for i in page]
+            size, read, send = page_cost(paths)
+            print(f"{kind:<12}{size / 1e3:>10.0f}{read * 1000:>10.2f}{send * 1000:>10.0f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
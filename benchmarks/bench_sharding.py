@@ -0,0 +1,86 @@
+# Throughput of the sharded worker mode against the fake Bot API.
+#
+#   python benchmarks/bench_sharding.py [updates] [workers ...]
+#
+# Starts bot.py as a real process for each worker count, queues a burst of
+# /start updates from different users and measures how long it takes until
+# every user got a reply. The fake runs in this process, so give the
+# machine at least one core more than the largest worker count.
+
+import os
+import sys
+import time
+import shutil
+import signal
+import asyncio
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+WORKERS = [int(n) for n in sys.argv[2:]] or [1, 2, 4]
+
+async def wait_for(predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError
+        await asyncio.sleep(0.01)
+
+async def run(workers, fake, api_port, tmp):
+    env = dict(os.environ,
+               BOT_TOKEN="123:fake",
+               BOT_API_URL=f"http://127.0.0.1:{api_port}",
+               DB_NAME=os.path.join(tmp, "orders.db"),
+               SHARD_WORKERS=str(workers),
+               BOT_MODE="polling")
+    fake.calls.clear()
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, "bot.py")], cwd=tmp, env=env,
+                           stdout=subprocess.DEVNULL)
+    try:
+        await wait_for(lambda: any(call[1] == "getUpdates" for call in fake.calls), 60)
+        # Give every worker time to finish initialize()
+        await asyncio.sleep(2)
+
+        replied = set()
+        def on_call(call):
+            if call[1] == "sendMessage":
+                replied.add(int(call[2]["chat_id"]))
+        fake.listeners.append(on_call)
+
+        started = time.perf_counter()
+        for user_id in range(1, UPDATES + 1):
+            fake.queue_update(fake.make_message_update(user_id, "/start"))
+        await wait_for(lambda: len(replied) >= UPDATES, 300)
+        elapsed = time.perf_counter() - started
+        fake.listeners.remove(on_call)
+        return elapsed
+    finally:
+        bot.send_signal(signal.SIGINT)
+        bot.wait(timeout=60)
+
+async def main():
+    tmp = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "products.json"), tmp)
+    fake = FakeTelegram()
+    api_port = await fake.start()
+    results = []
+    try:
+        for workers in WORKERS:
+            results.append((workers, await run(workers, fake, api_port, tmp)))
+    finally:
+        await fake.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"\n{UPDATES} /start updates, {os.cpu_count()} CPU(s)")
+    print(f"{'workers':<10}{'seconds':>10}{'updates/s':>12}")
+    for workers, elapsed in results:
+        print(f"{workers:<10}{elapsed:>10.2f}{UPDATES / elapsed:>12.0f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,133 @@
+# End-to-end latency of polling vs webhook mode against the fake Bot API.
+#
+#   python benchmarks/bench_webhook.py [updates] [simulated_rtt_ms] [interval_ms]
+#
+# Each update is a /start from a different user, arriving every interval_ms
+# without waiting for the previous reply. Latency is measured from the
+# moment Telegram (the stand-in) has the update until the bot's reply
+# reaches it.
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+UPDATES = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+RTT = (float(sys.argv[2]) if len(sys.argv) > 2 else 20.0) / 1000
+INTERVAL = (float(sys.argv[3]) if len(sys.argv) > 3 else 50.0) / 1000
+
+# webhook.py reads its settings at import time
+os.environ.update({
+    "WEBHOOK_URL": "http://127.0.0.1:18443",
+    "WEBHOOK_PORT": "18443",
+    "WEBHOOK_SECRET": "bench-secret",
+})
+
+from fake_telegram import FakeTelegram
+
+async def measure(fake, send_update):
+    pending = {}
+    def on_call(call):
+        _, method, params = call
+        future = pending.pop(int(params.get("chat_id", 0) or 0), None) if method == "sendMessage" else None
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+    fake.listeners.append(on_call)
+
+    loop = asyncio.get_running_loop()
+    async def one(user_id):
+        future = pending[user_id] = loop.create_future()
+        sent_at = time.perf_counter()
+        await send_update(fake.make_message_update(user_id, "/start"))
+        return await asyncio.wait_for(future, 30) - sent_at
+
+    tasks = []
+    for user_id in range(1, UPDATES + 1):
+        tasks.append(asyncio.create_task(one(user_id)))
+        await asyncio.sleep(INTERVAL)
+    latencies = await asyncio.gather(*tasks)
+    fake.listeners.remove(on_call)
+    return latencies
+
+async def run_polling(fake, bot):
+    app = bot.build_app()
+    await app.initialize()
+    await app.updater.start_polling(poll_interval=0, timeout=10)
+    await app.start()
+    try:
+        async def send(update):
+            fake.queue_update(update)
+        return await measure(fake, send)
+    finally:
+        await app.updater.stop()
+        await app.stop()
+        await app.shutdown()
+
+async def run_webhook(fake, bot, webhook):
+    import httpx
+    app = bot.build_app()
+    await app.initialize()
+    await app.bot.set_webhook(url=webhook.WEBHOOK_URL + webhook.WEBHOOK_PATH, secret_token=webhook.WEBHOOK_SECRET)
+    await app.start()
+    server = await webhook.start_server(webhook.WebhookApp(app), "127.0.0.1", webhook.WEBHOOK_PORT)
+    try:
+        async with httpx.AsyncClient() as client:
+            # A wrong secret must be rejected before it reaches the bot
+            url, _ = fake.webhook
+            bad = await client.post(url, json=fake.make_message_update(1, "/start"),
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            assert bad.status_code == 403, bad.status_code
+
+            async def send(update):
+                # Telegram itself is one RTT/2 away from the bot
+                await asyncio.sleep(RTT / 2)
+                status = await fake.deliver(client, update)
+                assert status == 200, status
+            return await measure(fake, send)
+    finally:
+        server.close()
+        await server.wait_closed()
+        await app.stop()
+        await app.shutdown()
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{name:<10}{statistics.mean(latencies) * 1000:>10.1f}{statistics.median(latencies) * 1000:>10.1f}{p95 * 1000:>10.1f}")
+
+async def main():
+    tmp = tempfile.mkdtemp()
+    shutil.copy(os.path.join(ROOT, "products.json"), tmp)
+    os.chdir(tmp)
+
+    fake = FakeTelegram(latency=RTT / 2)
+    api_port = await fake.start()
+    os.environ.update({
+        "BOT_TOKEN": "123:fake",
+        "BOT_API_URL": f"http://127.0.0.1:{api_port}",
+        "DB_NAME": os.path.join(tmp, "orders.db"),
+    })
+    import bot
+    import webhook
+
+    try:
+        polling = await run_polling(fake, bot)
+        webhook_latencies = await run_webhook(fake, bot, webhook)
+    finally:
+        await fake.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    print(f"\n{UPDATES} updates every {INTERVAL * 1000:.0f} ms, simulated RTT {RTT * 1000:.0f} ms")
+    print(f"{'mode':<10}{'mean, ms':>10}{'p50, ms':>10}{'p95, ms':>10}")
+    report("polling", polling)
+    report("webhook", webhook_latencies)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,250 @@
+# Local stand-in for the Telegram Bot API, for tests and benchmarks.
+#
+#   python benchmarks/fake_telegram.py [port]
+#
+# Point the bot at it with BOT_API_URL=http://127.0.0.1:<port>. It answers
+# the Bot API methods the bot uses with plausible results, records every
+# call, serves getUpdates long polling and can deliver updates to a webhook.
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import itertools
+from collections import deque
+from urllib.parse import parse_qsl
+from email.parser import BytesParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook import start_server
+
+def fake_jpeg(path):
+    # Any file download returns a small image that depends on the path
+    digest = hashlib.sha256(path.encode()).digest()
+    try:
+        from PIL import Image
+    except ImportError:
+        return b"\xff\xd8\xff\xe0" + digest + b"\xff\xd9"
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 128), tuple(digest[:3])).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, flood_limit=None):
+        # Simulated one-way network delay, applied to both the request and
+        # the response of every Bot API call
+        self.latency = latency
+        # Sends allowed per second across all chats before answering 429
+        self.flood_limit = flood_limit
+        self._recent_sends = deque()
+        self.flood_errors = 0
+        self.calls = []
+        self.listeners = []
+        self.webhook = None
+        # Like Telegram, updates stay here until a later offset confirms them
+        self._updates = []
+        self._new_updates = asyncio.Event()
+        self._message_ids = itertools.count(1000)
+        self._update_ids = itertools.count(1)
+        self._server = None
+
+    # ---------------- ASGI ----------------
+    async def __call__(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        parts = scope["path"].strip("/").split("/")
+        status = 200
+        if len(parts) >= 2 and parts[0].startswith("bot"):
+            params = self._parse(dict(scope["headers"]).get(b"content-type", b""), body)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self._flooded(parts[1]):
+                status = 429
+                payload = json.dumps({
+                    "ok": False, "error_code": 429,
+                    "description": "Too Many Requests: retry after 1", "parameters": {"retry_after": 1},
+                }).encode()
+            else:
+                result = await self.handle(parts[1], params)
+                payload = json.dumps({"ok": True, "result": result}).encode()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            content_type = b"application/json"
+        elif parts and parts[0] == "file":
+            payload = fake_jpeg(scope["path"])
+            content_type = b"image/jpeg"
+        else:
+            payload = b'{"ok": false}'
+            content_type = b"application/json"
+
+        await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", content_type)]})
+        await send({"type": "http.response.body", "body": payload})
+
+    def _parse(self, content_type, body):
+        if content_type.startswith(b"application/json"):
+            return json.loads(body or b"{}")
+        if content_type.startswith(b"application/x-www-form-urlencoded"):
+            params = {}
+            for key, value in parse_qsl(body.decode()):
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    params[key] = value
+            return params
+        if content_type.startswith(b"multipart/form-data"):
+            # Uploads: text fields are kept, files are replaced by their size
+            message = BytesParser().parsebytes(b"Content-Type: " + content_type + b"\r\n\r\n" + body)
+            params = {"_uploaded": 0}
+            for part in message.get_payload():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True)
+                if part.get_filename():
+                    params["_uploaded"] += len(payload)
+                    continue
+                try:
+                    params[name] = json.loads(payload)
+                except ValueError:
+                    params[name] = payload.decode()
+            return params
+        return {}
+
+    def _flooded(self, method):
+        if not self.flood_limit or not method.startswith(("send", "edit")):
+            return False
+        now = time.monotonic()
+        while self._recent_sends and now - self._recent_sends[0] > 1:
+            self._recent_sends.popleft()
+        if len(self._recent_sends) >= self.flood_limit:
+            self.flood_errors += 1
+            return True
+        self._recent_sends.append(now)
+        return False
+
+    # ---------------- Bot API ----------------
+    def _message(self, params, **extra):
+        chat_id = params.get("chat_id", 1)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id) if str(chat_id).lstrip("-").isdigit() else 1, "type": "private"},
+            "from": BOT_USER,
+        }
+        message.update(extra)
+        return message
+
+    async def handle(self, method, params):
+        call = (time.perf_counter(), method, params)
+        self.calls.append(call)
+        for listener in self.listeners:
+            listener(call)
+
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "setWebhook":
+            self.webhook = (params.get("url"), params.get("secret_token"))
+            return True
+        if method == "deleteWebhook":
+            self.webhook = None
+            return True
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if method in ("sendDocument", "sendPhoto"):
+            file_id = f"file{next(self._message_ids)}"
+            return self._message(params, photo=[{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}])
+        if method == "sendMediaGroup":
+            media = params.get("media") or []
+            messages = []
+            for item in media:
+                # Media sent by file_id keep it, uploads get a new one
+                file_id = item.get("media", "")
+                if file_id.startswith("attach://"):
+                    file_id = f"file{next(self._message_ids)}"
+                messages.append(self._message(params, caption=item.get("caption"), photo=[{"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}]))
+            return messages
+        if method == "getFile":
+            return {"file_id": params.get("file_id"), "file_unique_id": f"u{params.get('file_id')}", "file_size": 64, "file_path": f"photos/{params.get('file_id')}.jpg"}
+        return True
+
+    async def _get_updates(self, params):
+        offset = int(params.get("offset", 0) or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        timeout = float(params.get("timeout", 0) or 0)
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(self._updates)
+
+    # ---------------- Updates ----------------
+    def make_message_update(self, user_id, text):
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Buyer"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def make_callback_update(self, user_id, data):
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "chat_instance": "fake",
+                "data": data,
+                "from": {"id": user_id, "is_bot": False, "first_name": "Buyer"},
+                "message": self._message({"chat_id": user_id}, text="catalog"),
+            },
+        }
+
+    def queue_update(self, update):
+        # Delivered through getUpdates
+        self._updates.append(update)
+        self._new_updates.set()
+
+    async def deliver(self, client, update):
+        # Delivered to the registered webhook, like Telegram does
+        url, secret = self.webhook
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        response = await client.post(url, json=update, headers=headers)
+        return response.status_code
+
+    # ---------------- Server ----------------
+    async def start(self, host="127.0.0.1", port=0):
+        self._server = await start_server(self, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+async def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    fake = FakeTelegram()
+    fake.listeners.append(lambda call: print(f"{call[1]} {json.dumps(call[2], ensure_ascii=False)[:200]}"))
+    await fake.start(port=port)
+    print(f"Fake Bot API on http://127.0.0.1:{port}")
+    await asyncio.Event().wait()
+
+if __name__ == "__main__":
+    asyncio.run(main())
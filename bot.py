@@ -1,9 +1,9 @@
 import os
 import sys
 import json
-import sqlite3
+import asyncio
 from dotenv import load_dotenv
-from datetime import time
+from datetime import time, date, timedelta
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -15,20 +15,71 @@ from telegram.ext import (
     filters,
 )
 
+from db import (
+    init_db,
+    save_order,
+    update_payment,
+    get_user_orders,
+    get_latest_pending_order,
+    get_pending_review_batch,
+    get_stats,
+    get_payment_counts,
+    get_product_stats,
+    get_daily_stats,
+    rebuild_stats,
+    count_products,
+    import_products,
+    get_product,
+    get_all_products,
+    count_outbox,
+    reserve,
+    release_reservation,
+    reap_reservations,
+    count_reservations,
+    cancel_order,
+    close_pool,
+)
+from repository import run_db, shutdown_repository
+from catalog import Catalog
+from catalog_reload import CatalogReloader, PRODUCTS_FILE, CATALOG_WATCH_INTERVAL
+from broadcast import Broadcaster
+from outbound import OutboundLimiter, Outbox, OUTBOUND_RATE, OUTBOX_INTERVAL
+from notify import AdminNotifier
+from gallery import parse_gallery_args, load_gallery, send_review_gallery
+from reviews import ReviewIngestor, ReviewJob, build_missing_variants, evict_originals, shutdown_image_pool
+from webhook import run_webhook
+from transport import make_requests
+from sharding import run_sharded, SHARD_WORKERS, CATALOG_REFRESH_INTERVAL
+from processor import UserOrderedProcessor
+from export import export_orders_csv, mark_exported, parse_export_args
+from catalog_io import CATALOG_FORMATS, IMPORT_MAX_SIZE, document_format, parse_products_document, error_report, export_catalog
+from sessions import SessionStore, Session, make_backend, SESSION_FLUSH_INTERVAL
+from flow import FlowEngine, Step, State, Event, ANY, Invalid, field_step, positive_int, max_length, all_of, FLOW_STEP_TIMEOUT
+from keyboards import (
+    CatalogKeyboards,
+    PRODUCT_PREFIX,
+    PAGE_PREFIX,
+    NOOP,
+    parse_product_callback,
+    parse_page_callback,
+)
+
 # ================= LOAD ENV =================
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
-if not TOKEN:
-    print("❌ BOT_TOKEN not set.")
-    sys.exit(1)
 
 ADMIN_ID = 165665465
-DB_NAME = "orders.db"
-user_data_store = {}
+# "polling" (default) or "webhook", see webhook.py for the WEBHOOK_* settings
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "8"))
+# Stock is held for a buyer from the quantity step until the order is
+# saved; abandoned holds go back to stock after RESERVATION_TTL seconds
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", "1800"))
+RESERVATION_REAP_INTERVAL = 60
+RESERVATION_REAP_BATCH = 1000
 
 # ================= LOAD PRODUCTS =================
-PRODUCTS_FILE = "products.json"
-
 def load_products():
     try:
         with open(PRODUCTS_FILE, "r", encoding="utf-8") as f:
@@ -37,178 +88,50 @@ def load_products():
         print(f"❌ Error loading {PRODUCTS_FILE}: {e}")
         sys.exit(1)
 
-def save_products():
-    with open(PRODUCTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(products, f, ensure_ascii=False, indent=4)
-
-products = load_products()
-
-# ================= DATABASE =================
-def get_connection():
-    return sqlite3.connect(DB_NAME)
-
-def init_db():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                product_name TEXT,
-                product_link TEXT,
-                quantity INTEGER,
-                customer_name TEXT,
-                order_number TEXT,
-                payment_method TEXT,
-                payment_info TEXT,
-                review_sent INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        conn.commit()
-
-def save_order(user_id, data):
-    product = next((p for p in products if p["name"] == data["product_name"]), None)
-    if not product:
-        raise ValueError("Продукт не найден при сохранении заказа.")
-
-    # Check stock again just before saving
-    if data["quantity"] > product.get("stock", 0):
-        raise ValueError(f"Недостаточно товара на складе. Доступно: {product['stock']} шт.")
-
-    # Subtract ordered quantity from stock
-    product["stock"] -= data["quantity"]
-
-    # Save back to JSON file
-    with open("products.json", "w", encoding="utf-8") as f:
-        json.dump(products, f, ensure_ascii=False, indent=4)
-
-    # Save order in DB
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO orders 
-            (user_id, product_name, product_link, quantity, customer_name, order_number)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            user_id,
-            data["product_name"],
-            data["product_link"],
-            data["quantity"],
-            data["customer_name"],
-            data["order_number"]
-        ))
-        conn.commit()
-        return cursor.lastrowid
-
-def update_payment(order_id, method, info):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE orders 
-            SET payment_method=?, payment_info=? 
-            WHERE id=?
-        """, (method, info, order_id))
-        conn.commit()
-
-def mark_review_sent(order_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE orders SET review_sent=1 WHERE id=?", (order_id,))
-        conn.commit()
-
-def get_user_orders(user_id):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, product_name, quantity, created_at
-            FROM orders
-            WHERE user_id=?
-            ORDER BY created_at DESC
-        """, (user_id,))
-        return cursor.fetchall()
-
-def get_orders_pending_review():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, user_id, product_name FROM orders WHERE review_sent=0")
-        return cursor.fetchall()
-
-def get_all_orders():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, user_id, product_name, product_link, quantity, customer_name, order_number, payment_method, payment_info, review_sent, created_at
-            FROM orders
-            ORDER BY created_at DESC
-        """)
-        return cursor.fetchall()
-
-import csv
-
-def save_all_orders_to_csv():
-    orders = get_all_orders()
-    if not orders:
-        return None
-    
-    filename = "all_orders.csv"
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        
-        # Header row with Product Name and Link at the end
-        writer.writerow([
-            "ID", "User ID", "Quantity", "Customer Name", "Order Number",
-            "Payment Method", "Payment Info", "Review Sent", "Created At",
-            "Product Name", "Product Link"
-        ])
-        
-        # Write each order with reordered columns
-        for order in orders:
-            writer.writerow([
-                order[0],  # ID
-                order[1],  # User ID
-                order[4],  # Quantity
-                order[5] or "—",  # Customer Name
-                order[6] or "—",  # Order Number
-                order[7] or "—",  # Payment Method
-                order[8] or "—",  # Payment Info
-                "✅" if order[9] else "❌",  # Review Sent
-                order[10],  # Created At
-                order[2],  # Product Name
-                order[3],  # Product Link
-            ])
-    return filename
-
-def get_stats():
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM orders")
-        total_orders = cursor.fetchone()[0]
-
-        cursor.execute("SELECT SUM(quantity) FROM orders")
-        total_quantity = cursor.fetchone()[0] or 0
-
-        return total_orders, total_quantity
-
-init_db()
+def seed_products():
+    # products.json is only an import format now; stock lives in orders.db
+    if count_products() == 0:
+        count = import_products(load_products())
+        print(f"✅ Импортировано товаров из {PRODUCTS_FILE}: {count}")
+
+# ================= STARTUP =================
+# Nothing below touches the database at import time: review image
+# processes are spawned and re-import this module (see reviews.py).
+catalog = Catalog()
+catalog_keyboards = CatalogKeyboards(catalog, CATALOG_PAGE_SIZE)
+sessions = SessionStore(make_backend())
+review_ingestor = ReviewIngestor()
+admin_notifier = AdminNotifier(ADMIN_ID)
+outbox = Outbox()
+catalog_reloader = CatalogReloader()
+
+def startup():
+    # Runs in every process that serves updates, before the app is built
+    if not TOKEN:
+        print("❌ BOT_TOKEN not set.")
+        sys.exit(1)
+    init_db()
+    seed_products()
+    catalog.sync(get_all_products())
 
 # ================= COMMANDS =================
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    user_data_store[user_id] = {}
+    session = await sessions.get(user_id)
+    if session.state in HOLDING_STATES:
+        await release_hold(user_id)
+    await sessions.reset(user_id)
 
     # Only show products with stock > 0
-    available_products = [p for p in products if p.get("stock", 0) > 0]
-    if not available_products:
+    if not catalog.available():
         await update.message.reply_text("Все товары распроданы 😢")
         return
 
-    keyboard = [[InlineKeyboardButton(p["name"], callback_data=f"product_{p['name']}")] for p in available_products]
-    await update.message.reply_text("Здравствуйте! Выберите ваш заказ:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await update.message.reply_text("Здравствуйте! Выберите ваш заказ:", reply_markup=catalog_keyboards.page(0))
 
 async def my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    orders = get_user_orders(user_id)
+    orders = await run_db(get_user_orders, user_id)
     if not orders:
         await update.message.reply_text("У вас пока нет заказов.")
         return
@@ -223,241 +146,524 @@ async def all_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Нет доступа.")
         return
 
-    filename = save_all_orders_to_csv()
-    if not filename:
+    try:
+        options = parse_export_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(f"{e}\nФормат: /allorders [new] [gz] [ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]]")
+        return
+
+    # Long exports get their own thread and connection so they do not hold
+    # up the DB executor used by buyer-facing handlers
+    export = await asyncio.to_thread(export_orders_csv, **options)
+    if not export:
         await update.message.reply_text("Нет заказов для экспорта.")
         return
 
-    # Send the CSV file to the admin
-    with open(filename, "rb") as f:
-        await update.message.reply_document(f, filename=filename)
+    # Send the CSV file to the admin. PTB reads the whole upload into
+    # memory anyway, so hand it the bytes of the (compressed) file.
+    try:
+        await update.message.reply_document(export.buffer.read(), filename=export.filename)
+    finally:
+        export.close()
+    await run_db(mark_exported, export)
+
+    await update.message.reply_text(f"📊 Экспортировано заказов: {export.count} ✅")
+
+STATS_DAYS = 7
+STATS_TOP_PRODUCTS = 5
 
-    await update.message.reply_text("📊 Все заказы экспортированы в CSV и отправлены ✅")
+def load_stats():
+    since_day = (date.today() - timedelta(days=STATS_DAYS - 1)).isoformat()
+    return get_stats(), get_payment_counts(), get_product_stats(STATS_TOP_PRODUCTS), get_daily_stats(since_day), count_outbox(), count_reservations()
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("Нет доступа.")
         return
 
-    total_orders, total_quantity = get_stats()
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT payment_method, COUNT(*) FROM orders
-            WHERE payment_method IS NOT NULL
-            GROUP BY payment_method
-        """)
-        payment_counts = cursor.fetchall()
+    if context.args and context.args[0] == "rebuild":
+        await asyncio.to_thread(rebuild_stats)
+        await update.message.reply_text("🔄 Статистика пересчитана.")
+
+    (total_orders, total_quantity), payment_counts, product_stats, daily_stats, outbox_pending, (holds, held_units) = await run_db(load_stats)
     payment_summary = "\n".join([f"{row[0]}: {row[1]}" for row in payment_counts]) or "Нет данных об оплате."
+    product_summary = "\n".join([f"{row[0]}: {row[2]} шт. ({row[1]} зак.)" for row in product_stats]) or "—"
+    daily_summary = "\n".join([f"{row[0]}: {row[1]} зак., {row[2]} шт." for row in daily_stats]) or "—"
 
     await update.message.reply_text(
         f"📈 Статистика:\nВсего заказов: {total_orders}\nВсего продано товаров: {total_quantity}\nОплаты:\n{payment_summary}"
+        f"\n\nТоп товаров:\n{product_summary}\n\nЗа {STATS_DAYS} дней:\n{daily_summary}"
+        f"\n\n⚙️ Обновления:\n{context.application.update_processor.summary()}"
+        f"\n\n{review_ingestor.summary()}\n{admin_notifier.summary()}"
+        f"\n\n{context.bot.rate_limiter.summary()}\n{outbox.summary(outbox_pending)}"
+        f"\nРезервы: {holds} ({held_units} шт.)"
     )
 
+async def review_gallery(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("Нет доступа.")
+        return
+
+    try:
+        options = parse_gallery_args(context.args)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+
+    reviews = await run_db(load_gallery, **options)
+    if not reviews:
+        await update.message.reply_text("Новых скриншотов нет." if options.get("unviewed_only") else "Скриншоты не найдены.")
+        return
+
+    sent, missing = await send_review_gallery(context.bot, update.effective_chat.id, reviews)
+    found = {review[0] for review in reviews}
+    missing += [order_id for order_id in options.get("order_ids", []) if order_id not in found]
+    if missing:
+        await update.message.reply_text(f"Скриншоты не найдены для заказов: {', '.join(map(str, missing))}")
+
+async def reload_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("Нет доступа.")
+        return
+    await update.message.reply_text(await catalog_reloader.reload(catalog))
+
+async def import_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # The admin sends a .csv (name, link, stock) or .json (products.json
+    # format) document; valid rows are upserted with the given stock (not
+    # added to it), the rest are reported
+    document = update.message.document
+    fmt = document_format(document.file_name)
+    if not fmt:
+        await update.message.reply_text(f"Поддерживаются файлы: {', '.join(CATALOG_FORMATS)}")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_SIZE:
+        await update.message.reply_text("Файл больше 20 МБ, разбейте его на части.")
+        return
+
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+    # Parsing and validating 50k rows takes a while; keep it off the event loop
+    products, errors = await asyncio.to_thread(parse_products_document, data, fmt)
+    if products:
+        report = await catalog_reloader.apply(catalog, products)
+    else:
+        report = "❌ В файле нет ни одного корректного товара."
+    if errors:
+        report += f"\nПропущено строк с ошибками: {len(errors)}, список в файле."
+    await update.message.reply_text(report)
+    if errors:
+        content, filename = error_report(errors, document.file_name)
+        await update.message.reply_document(content, filename=filename)
+
+async def export_catalog_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("Нет доступа.")
+        return
+
+    fmt = (context.args[0].lower() if context.args else "csv").lstrip(".")
+    if fmt not in CATALOG_FORMATS:
+        await update.message.reply_text(f"Формат: /exportcatalog [{'|'.join(CATALOG_FORMATS)}]")
+        return
+
+    export = await asyncio.to_thread(export_catalog, fmt)
+    try:
+        await update.message.reply_document(export.buffer.read(), filename=export.filename)
+    finally:
+        export.close()
+    await update.message.reply_text(f"📦 Экспортировано товаров: {export.count} ✅")
+
 # ================= CALLBACK HANDLER =================
+# Callback data -> flow event: exact values first, then "prefix:" buttons
+PAYMENT_METHODS = {"zelle": "Zelle", "venmo": "Venmo"}
+CALLBACK_EVENTS = {NOOP: Event.NOOP, "cancel": Event.CANCEL, **{key: Event.PAYMENT for key in PAYMENT_METHODS}}
+CALLBACK_PREFIXES = {PRODUCT_PREFIX: Event.PRODUCT, PAGE_PREFIX: Event.PAGE}
+
+def callback_event(data):
+    event = CALLBACK_EVENTS.get(data)
+    if event is not None:
+        return event
+    # Keyboards sent before product ids were introduced carry the name
+    if data.startswith("product_"):
+        return Event.PRODUCT
+    head, sep, _ = data.partition(":")
+    return CALLBACK_PREFIXES.get(head + sep, Event.UNKNOWN)
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    user_id = query.from_user.id
-    data = user_data_store.setdefault(user_id, {})
+    # Only stops the button's loading spinner, so it need not hold up the reply
+    context.application.create_task(query.answer(), update=update)
+    session = await sessions.get(query.from_user.id)
 
     try:
-        if query.data.startswith("product_"):
-            await handle_product_selection(update, data)
-        elif query.data in ["zelle", "venmo"]:
-            await handle_payment_selection(update, data)
-        elif query.data == "cancel":
-            await handle_cancel(update, user_id)
-        else:
-            await query.edit_message_text("Неизвестная команда.")
+        session = await order_flow.dispatch(update, context, session, callback_event(query.data), query.data)
     except Exception as e:
         print(f"Ошибка в button_handler: {e}")
         await query.edit_message_text("Произошла ошибка при обработке кнопки.")
+    finally:
+        sessions.mark_dirty(session)
 
 # ================= PRODUCT SELECTION =================
-async def handle_product_selection(update: Update, data: dict):
-    product_name = update.callback_query.data.replace("product_", "")
-    product = next((p for p in products if p["name"] == product_name), None)
+async def handle_product_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, data: str):
+    # Picking a product again gives back the units held for the previous pick
+    if session.state in HOLDING_STATES:
+        await release_hold(session.user_id)
 
-    if not product or product.get("stock", 0) <= 0:
+    if data.startswith(PRODUCT_PREFIX):
+        product = catalog.get(parse_product_callback(data))
+    else:
+        product = catalog.find_by_name(data.replace("product_", ""))
+
+    if not product or product["stock"] <= 0:
         await update.callback_query.edit_message_text("Продукт недоступен или распродан.")
-        return
+        return None
+
+    session.product_id = product["id"]
+    session.product_name = product["name"]
 
-    data["product_name"] = product["name"]
-    data["product_link"] = product["link"]
+    await update.callback_query.message.reply_text(
+        f"🔗 Ссылка на товар:\n{product['link']}\n\nВы выбрали: {product['name']}\nВведите количество:"
+    )
+    return State.QUANTITY
 
-    await update.callback_query.message.reply_text(f"🔗 Ссылка на товар:\n{product['link']}")
-    await update.callback_query.message.reply_text(f"Вы выбрали: {product_name}\nВведите количество:")
+async def handle_catalog_page(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, data: str):
+    if not catalog.available():
+        await update.callback_query.edit_message_text("Все товары распроданы 😢")
+        return
+    page = parse_page_callback(data)
+    await update.callback_query.edit_message_reply_markup(reply_markup=catalog_keyboards.page(page))
 
-async def handle_payment_selection(update: Update, data: dict):
-    data["payment_method"] = update.callback_query.data.capitalize()
-    data["awaiting_payment_info"] = True
+async def handle_payment_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, data: str):
+    session.payment_method = PAYMENT_METHODS[data]
     await update.callback_query.edit_message_text(
-        f"Вы выбрали {data['payment_method']}.\nВведите данные для оплаты:"
+        f"Вы выбрали {session.payment_method}.\nВведите данные для оплаты:"
     )
 
-async def handle_cancel(update: Update, user_id: int):
-    user_data_store[user_id] = {}
+async def handle_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, data: str):
+    if session.state in (State.PAYMENT_METHOD, State.PAYMENT_INFO) and session.order_id:
+        # Saved but not paid yet: the order is dropped and its stock returned
+        changed = await run_db(cancel_order, session.user_id, session.order_id)
+        if changed is not None:
+            apply_stock(changed)
+            # The admin was told about the order, so tell them it is gone
+            admin_notifier.notify(
+                context.bot, "❌ Отмен", f"❌ #{session.order_id} {session.product_name} × {session.quantity} отменён покупателем"
+            )
+    else:
+        await release_hold(session.user_id)
+    await sessions.reset(session.user_id)
     await update.callback_query.edit_message_text("❌ Заказ отменён.")
 
+async def handle_unknown_button(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, data: str):
+    await update.callback_query.edit_message_text("Неизвестная команда.")
+
+async def ignore(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, data):
+    pass
+
 # ================= MESSAGE HANDLER =================
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = update.effective_user.id
-    data = user_data_store.setdefault(user_id, {})
-
     if update.message.photo:
-        await handle_photo(update, user_id)
-        return
-
-    text = (update.message.text or "").strip()
-    if not text:
-        await update.message.reply_text("Пожалуйста, введите текстовое сообщение.")
-        return
-
-    if "product_name" not in data:
-        await update.message.reply_text("Используйте /start, чтобы выбрать товар.")
-        return
-    if "quantity" not in data:
-        await handle_quantity(update, data, text)
-        return
-    if "customer_name" not in data:
-        await handle_customer_name(update, data, text)
-        return
-    if "order_number" not in data:
-        await handle_order_number(update, context, data, text)
-        return
-    if data.get("awaiting_payment_info"):
-        await handle_payment(update, context, data, text)
-        return
+        event, payload = Event.PHOTO, None
+    else:
+        payload = (update.message.text or "").strip()
+        if not payload:
+            await update.message.reply_text("Пожалуйста, введите текстовое сообщение.")
+            return
+        event = Event.TEXT
+
+    session = await sessions.get(update.effective_user.id)
+    try:
+        session = await order_flow.dispatch(update, context, session, event, payload)
+    finally:
+        sessions.mark_dirty(session)
 
 # ================= HANDLE QUANTITY =================
-async def handle_quantity(update: Update, data: dict, text: str):
-    if not text.isdigit() or int(text) <= 0:
-        await update.message.reply_text("Введите положительное число.")
-        return
-    
-    requested_qty = int(text)
-    product = next((p for p in products if p["name"] == data["product_name"]), None)
-    
+def in_stock(session: Session, quantity: int):
+    product = catalog.get(session.product_id)
     if not product:
-        await update.message.reply_text("Ошибка: продукт не найден.")
-        return
-    
-    if requested_qty > product.get("stock", 0):
-        await update.message.reply_text(f"Извините, на складе доступно только {product['stock']} шт.")
-        return
+        raise Invalid("Ошибка: продукт не найден.")
+    if quantity > product["stock"]:
+        raise Invalid(f"Извините, на складе доступно только {product['stock']} шт.")
+    return quantity
 
-    # Deduct stock
-    product["stock"] -= requested_qty
-    save_products()
-
-    data["quantity"] = requested_qty
+async def handle_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, quantity: int):
+    # The units are held until the order is saved or the hold expires
+    try:
+        changed = await run_db(reserve, session.user_id, session.product_id, quantity, RESERVATION_TTL)
+    except ValueError as e:
+        product = await run_db(get_product, session.product_id)
+        if product:
+            catalog.set_stock(product["id"], product["stock"])
+        # Stay on this step so the buyer can enter a smaller quantity
+        await update.message.reply_text(str(e))
+        return State.QUANTITY
+    apply_stock(changed)
+    session.quantity = quantity
     await update.message.reply_text("Введите ваше полное имя:")
 
 # ================= HANDLE CUSTOMER INFO =================
-async def handle_customer_name(update: Update, data: dict, text: str):
-    data["customer_name"] = text
-    await update.message.reply_text("Введите номер заказа Amazon:")
-
-async def handle_order_number(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict, text: str):
-    data["order_number"] = text
-    order_id = save_order(update.effective_user.id, data)
-    data["order_id"] = order_id
-
-    await context.bot.send_message(
-        ADMIN_ID,
-        f"📦 Новый заказ\nID: {order_id}\nПродукт: {data['product_name']}\nКол-во: {data['quantity']}"
-    )
+async def handle_order_number(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, text: str):
+    session.order_number = text
+    try:
+        order_id, remaining = await run_db(save_order, update.effective_user.id, session.to_dict())
+    except ValueError as e:
+        # Stock changed under us, resync this product from the database
+        product = await run_db(get_product, session.product_id)
+        if product:
+            catalog.set_stock(product["id"], product["stock"])
+        await sessions.reset(update.effective_user.id)
+        await update.message.reply_text(f"{e}\nИспользуйте /start, чтобы выбрать товар.")
+        return State.IDLE
+    session.order_id = order_id
+    catalog.set_stock(session.product_id, remaining)
+
+    admin_notifier.notify(context.bot, "📦 Заказов", f"📦 #{order_id} {session.product_name} × {session.quantity}")
 
     keyboard = [
-        [InlineKeyboardButton("Zelle", callback_data="zelle"), InlineKeyboardButton("Venmo", callback_data="venmo")],
+        [InlineKeyboardButton(label, callback_data=key) for key, label in PAYMENT_METHODS.items()],
         [InlineKeyboardButton("❌ Отменить", callback_data="cancel")]
     ]
     await update.message.reply_text(
         "Как хотите получить оплату?",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
+    return State.PAYMENT_METHOD
 
 # ================= HANDLE PAYMENT =================
-async def handle_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict, text: str):
-    order_id = data.get("order_id")
-    method = data.get("payment_method")
+async def handle_payment(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, text: str):
+    order_id = session.order_id
+    method = session.payment_method
     if not order_id or not method:
         await update.message.reply_text("Ошибка обработки оплаты. Пожалуйста, попробуйте снова.")
         return
 
-    update_payment(order_id, method, text)
-    await context.bot.send_message(
-        ADMIN_ID,
-        f"💰 Оплата добавлена\nID: {order_id}\nМетод: {method}\nДанные: {text}"
-    )
-    await update.message.reply_text("✅ Оплата сохранена.")
-
-    user_data_store[update.effective_user.id] = {}
+    await run_db(update_payment, order_id, method, text)
+    admin_notifier.notify(context.bot, "💰 Оплат", f"💰 #{order_id} {method}: {text}")
+    await sessions.reset(update.effective_user.id)
 
     await update.message.reply_text(
-        f"Пожалуйста, пришлите скриншот вашего отзыва для товара: {data.get('product_name', '—')} ✅"
+        f"✅ Оплата сохранена.\n\nПожалуйста, пришлите скриншот вашего отзыва для товара: {session.product_name or '—'} ✅"
     )
+    return State.IDLE
 
 # ================= HANDLE PHOTO =================
-async def handle_photo(update: Update, user_id: int):
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id FROM orders
-            WHERE user_id=? AND review_sent=0
-            ORDER BY created_at DESC LIMIT 1
-        """, (user_id,))
-        order = cursor.fetchone()
+async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session, data):
+    user_id = update.effective_user.id
+    order = await run_db(get_latest_pending_order, user_id, review_ingestor.in_flight)
 
     if not order:
         await update.message.reply_text("Нет активного заказа для добавления скриншота.")
         return
 
-    order_id = order[0]
-    os.makedirs("reviews", exist_ok=True)
+    # The download happens in the background, see reviews.py
+    photo = update.message.photo[-1]
+    job = ReviewJob(user_id, update.effective_chat.id, order[0], photo.file_id, photo.file_unique_id)
+    if not review_ingestor.submit(update.get_bot(), job):
+        await update.message.reply_text("Сейчас слишком много скриншотов, отправьте, пожалуйста, ещё раз через минуту.")
+        return
+    await update.message.reply_text("Спасибо за ваш отзыв! ✅")
+
+# ================= ORDER FLOW =================
+async def expire_order_flow(update: Update, context: ContextTypes.DEFAULT_TYPE, session: Session):
+    if session.state in HOLDING_STATES:
+        await release_hold(session.user_id)
+    await update.effective_message.reply_text("⌛ Время оформления заказа истекло.")
+    return await sessions.reset(session.user_id)
+
+# (state, event) -> step. Updates without a transition get the state's
+# prompt; new steps are new rows here, see flow.py.
+order_flow = FlowEngine(
+    {
+        (ANY, Event.PRODUCT): Step(handle_product_selection),
+        (ANY, Event.PAGE): Step(handle_catalog_page),
+        (ANY, Event.CANCEL): Step(handle_cancel, next_state=State.IDLE),
+        (ANY, Event.NOOP): Step(ignore),
+        (ANY, Event.UNKNOWN): Step(handle_unknown_button),
+        (ANY, Event.PHOTO): Step(handle_photo),
+        (State.QUANTITY, Event.TEXT): Step(handle_quantity, all_of(positive_int, in_stock), State.CUSTOMER_NAME),
+        (State.CUSTOMER_NAME, Event.TEXT): field_step(
+            "customer_name", "Введите номер заказа Amazon:", State.ORDER_NUMBER, max_length(200)
+        ),
+        (State.ORDER_NUMBER, Event.TEXT): Step(handle_order_number, max_length(100)),
+        (State.PAYMENT_METHOD, Event.PAYMENT): Step(handle_payment_selection, next_state=State.PAYMENT_INFO),
+        (State.PAYMENT_INFO, Event.TEXT): Step(handle_payment),
+    },
+    prompts={
+        State.IDLE: "Используйте /start, чтобы выбрать товар.",
+        State.QUANTITY: "Введите количество:",
+        State.CUSTOMER_NAME: "Введите ваше полное имя:",
+        State.ORDER_NUMBER: "Введите номер заказа Amazon:",
+        State.PAYMENT_METHOD: "Выберите способ оплаты кнопками выше.",
+        State.PAYMENT_INFO: "Введите данные для оплаты:",
+    },
+    # Until the order is saved; after that the session TTL applies
+    timeouts={state: FLOW_STEP_TIMEOUT for state in (State.QUANTITY, State.CUSTOMER_NAME, State.ORDER_NUMBER)},
+    on_timeout=expire_order_flow,
+)
+
+# ================= DAILY REMINDERS =================
+REMINDER_BATCH_SIZE = 500
+
+async def pending_review_messages():
+    last_user_id = -1
+    while True:
+        batch = await run_db(get_pending_review_batch, last_user_id, REMINDER_BATCH_SIZE)
+        if not batch:
+            return
+        for user_id, product_names in batch:
+            # One message per user, however many orders are waiting
+            if len(product_names) == 1:
+                yield user_id, f"Здравствуйте! Пожалуйста, пришлите скриншот вашего отзыва для товара: {product_names[0]} ✅"
+            else:
+                items = "\n".join(f"• {name}" for name in product_names)
+                yield user_id, f"Здравствуйте! Пожалуйста, пришлите скриншоты ваших отзывов для товаров:\n{items}\n✅"
+        last_user_id = batch[-1][0]
 
+async def review_reminder(context: ContextTypes.DEFAULT_TYPE):
+    stats = await Broadcaster(context.bot).run("Напоминания об отзывах", pending_review_messages())
+    context.bot_data["last_review_reminder"] = stats
+    print(f"📨 {stats.summary()}")
+
+# ================= RESERVATIONS =================
+# States in which the buyer may hold stock (see handle_quantity)
+HOLDING_STATES = (State.CUSTOMER_NAME, State.ORDER_NUMBER)
+
+def apply_stock(changed):
+    for product_id, stock in changed:
+        catalog.set_stock(product_id, stock)
+
+async def release_hold(user_id):
+    apply_stock(await run_db(release_reservation, user_id))
+
+async def reap_reservations_job(context: ContextTypes.DEFAULT_TYPE):
+    # Expired holds go back to stock in bulk, oldest first
+    released = 0
+    while True:
+        count, changed = await run_db(reap_reservations, RESERVATION_REAP_BATCH)
+        apply_stock(changed)
+        released += count
+        if count < RESERVATION_REAP_BATCH:
+            break
+    if released:
+        print(f"🔓 Снято истёкших резервов: {released}")
+
+# ================= OUTBOX =================
+async def deliver_outbox(context: ContextTypes.DEFAULT_TYPE):
+    sent = await outbox.deliver(context.bot)
+    if sent:
+        print(f"📨 Отложенных сообщений обработано: {sent}")
+
+# ================= SESSIONS =================
+async def flush_sessions(context: ContextTypes.DEFAULT_TYPE):
     try:
-        file = await update.message.photo[-1].get_file()
-        file_path = f"reviews/review_{user_id}_{order_id}.jpg"
-        await file.download_to_drive(file_path)
-        mark_review_sent(order_id)
-        await update.message.reply_text("Спасибо за ваш отзыв! ✅")
-        print(f"Сохранён скриншот: {file_path}")
+        await sessions.flush()
     except Exception as e:
-        await update.message.reply_text("Ошибка при сохранении скриншота.")
-        print(f"Ошибка при сохранении скриншота: {e}")
+        print(f"Не удалось сохранить сессии: {e}")
 
-# ================= DAILY REMINDERS =================
-async def review_reminder(context: ContextTypes.DEFAULT_TYPE):
-    orders = get_orders_pending_review()
-    for order_id, user_id, product_name in orders:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"Здравствуйте! Пожалуйста, пришлите скриншот вашего отзыва для товара: {product_name} ✅"
-            )
-        except Exception as e:
-            print(f"Не удалось отправить напоминание пользователю {user_id}: {e}")
+async def maintain_sessions(context: ContextTypes.DEFAULT_TYPE):
+    purged = await sessions.maintain()
+    if purged:
+        print(f"Удалено устаревших сессий: {purged}")
+
+async def maintain_reviews(context: ContextTypes.DEFAULT_TYPE):
+    built = await build_missing_variants()
+    # Can take a while on a big backlog; keep it off the DB executor
+    evicted = await asyncio.to_thread(evict_originals)
+    if built or evicted:
+        print(f"Скриншоты: создано превью {built}, удалено оригиналов {evicted}")
 
 # ================= RUN BOT =================
-if __name__ == "__main__":
-    app = ApplicationBuilder().token(TOKEN).build()
+async def on_stop(app):
+    # Runs after updates stop and before Application.shutdown() closes the
+    # bot's HTTP clients, so queued screenshots can still be downloaded and
+    # the last admin digest can still be sent
+    await review_ingestor.close()
+    await admin_notifier.close()
+
+async def on_shutdown(app):
+    shutdown_image_pool()
+    await sessions.flush()
+    shutdown_repository()
+    close_pool()
+
+async def watch_catalog(context: ContextTypes.DEFAULT_TYPE):
+    # Picks up edits to products.json without a restart
+    if catalog_reloader.changed():
+        print(await catalog_reloader.reload(catalog))
+
+async def refresh_catalog(context: ContextTypes.DEFAULT_TYPE):
+    # Other workers sell stock too; pick up their changes from the database
+    catalog.sync(await run_db(get_all_products))
+
+def make_builder(shards=1):
+    # Different users are served in parallel, each user's updates in order.
+    # All sends share one rate limiter; sharded workers split the global rate.
+    request, updates_request = make_requests()
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .request(request)
+        .get_updates_request(updates_request)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+        .concurrent_updates(UserOrderedProcessor())
+        .rate_limiter(OutboundLimiter(OUTBOUND_RATE / shards))
+    )
+    if BOT_API_URL:
+        # e.g. a local Bot API server or the stand-in in benchmarks/fake_telegram.py
+        builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot").base_file_url(f"{BOT_API_URL.rstrip('/')}/file/bot")
+    return builder
+
+def build_app(shard=None, shards=1):
+    # shard is set for worker processes in sharded mode (see sharding.py);
+    # they get their updates from the front process, not from an updater
+    startup()
+    builder = make_builder(shards)
+    if shard is not None:
+        builder = builder.updater(None)
+    app = builder.build()
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("myorders", my_orders))
     app.add_handler(CommandHandler("allorders", all_orders))
     app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("reviews", review_gallery))
+    app.add_handler(CommandHandler("reload", reload_catalog))
+    app.add_handler(CommandHandler("exportcatalog", export_catalog_command))
+    app.add_handler(MessageHandler(filters.Document.ALL & filters.User(ADMIN_ID), import_catalog))
     app.add_handler(CallbackQueryHandler(button_handler))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_handler(MessageHandler(filters.PHOTO, handle_message))
 
-    # Daily reminders
-    app.job_queue.run_daily(review_reminder, time=time(10, 0))
-    app.job_queue.run_daily(review_reminder, time=time(18, 0))
+    # Write-behind session persistence
+    app.job_queue.run_repeating(flush_sessions, interval=SESSION_FLUSH_INTERVAL)
+
+    if shards > 1:
+        app.job_queue.run_repeating(refresh_catalog, interval=CATALOG_REFRESH_INTERVAL)
+    if not shard:
+        # Jobs for the whole bot run in one process only
+        app.job_queue.run_daily(review_reminder, time=time(10, 0))
+        app.job_queue.run_daily(review_reminder, time=time(18, 0))
+        app.job_queue.run_repeating(maintain_sessions, interval=3600)
+        app.job_queue.run_daily(maintain_reviews, time=time(4, 0))
+        # Messages spooled before a restart go out shortly after start
+        app.job_queue.run_repeating(deliver_outbox, interval=OUTBOX_INTERVAL, first=5)
+        app.job_queue.run_repeating(reap_reservations_job, interval=RESERVATION_REAP_INTERVAL, first=RESERVATION_REAP_INTERVAL)
+        if CATALOG_WATCH_INTERVAL:
+            app.job_queue.run_repeating(watch_catalog, interval=CATALOG_WATCH_INTERVAL, first=0)
+    return app
 
-    print("✅ Bot running...")
-    app.run_polling()
+if __name__ == "__main__":
+    if SHARD_WORKERS > 1:
+        # Migrate and seed once before the workers are forked
+        startup()
+        print(f"✅ Bot running ({BOT_MODE}, {SHARD_WORKERS} workers)...")
+        run_sharded(build_app, make_builder().updater(None).build().bot, BOT_MODE, SHARD_WORKERS)
+    elif BOT_MODE == "webhook":
+        print("✅ Bot running (webhook)...")
+        asyncio.run(run_webhook(build_app()))
+    else:
+        print("✅ Bot running...")
+        build_app().run_polling()
     
 # import os
 # import sys
@@ -0,0 +1,89 @@
+import os
+import time
+import asyncio
+
+from telegram.error import Forbidden, BadRequest, RetryAfter, TelegramError
+
+from outbound import outbound_args, PRIORITY_REMINDER
+
+# ================= SETTINGS =================
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_QUEUE_SIZE = 500
+
+# ================= STATS =================
+class BroadcastStats:
+    def __init__(self, name):
+        self.name = name
+        self.started_at = time.monotonic()
+        self.finished_at = None
+        self.sent = 0
+        self.blocked = 0
+        self.spooled = 0
+        self.rate_limited = 0
+
+    @property
+    def duration(self):
+        end = self.finished_at or time.monotonic()
+        return end - self.started_at
+
+    @property
+    def throughput(self):
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def summary(self):
+        return (
+            f"{self.name}: отправлено {self.sent}, заблокировали бота {self.blocked}, "
+            f"отложено {self.spooled}, 429: {self.rate_limited}, "
+            f"{self.duration:.1f} с ({self.throughput:.1f} сообщ./с)"
+        )
+
+# ================= BROADCASTER =================
+class Broadcaster:
+    # Streams (chat_id, text) pairs from an async iterator into a bounded
+    # queue and sends them from a pool of workers. Pacing, RetryAfter and
+    # retrying failed sends are left to the bot's rate limiter and outbox
+    # (see outbound.py), which put these sends behind interactive replies.
+    def __init__(self, bot, workers=BROADCAST_WORKERS, priority=PRIORITY_REMINDER):
+        self.bot = bot
+        self.workers = workers
+        self.priority = priority
+
+    async def run(self, name, messages):
+        stats = BroadcastStats(name)
+        queue = asyncio.Queue(maxsize=BROADCAST_QUEUE_SIZE)
+        tasks = [asyncio.create_task(self._worker(queue, stats)) for _ in range(self.workers)]
+        try:
+            async for chat_id, text in messages:
+                await queue.put((chat_id, text))
+            await queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            stats.finished_at = time.monotonic()
+        return stats
+
+    async def _worker(self, queue, stats):
+        while True:
+            chat_id, text = await queue.get()
+            try:
+                await self._send(chat_id, text, stats)
+            finally:
+                queue.task_done()
+
+    async def _send(self, chat_id, text, stats):
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, rate_limit_args=outbound_args(self.priority))
+            stats.sent += 1
+        except (Forbidden, BadRequest) as e:
+            # User blocked the bot or the chat no longer exists
+            stats.blocked += 1
+            print(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+        except RetryAfter as e:
+            stats.rate_limited += 1
+            stats.spooled += 1
+            print(f"Сообщение пользователю {chat_id} отложено: {e}")
+        except TelegramError as e:
+            # The limiter has put it in the outbox, it is sent again later
+            stats.spooled += 1
+            print(f"Сообщение пользователю {chat_id} отложено: {e}")
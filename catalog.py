@@ -0,0 +1,80 @@
+# ================= IN-MEMORY CATALOG =================
+# Products are plain dicts ({"id", "name", "link", "stock"}) as returned by
+# db.py. Every per-message lookup goes through one of the dict indexes below;
+# only the list of in-stock products is rebuilt, and only when a product
+# goes in or out of stock.
+
+class Catalog:
+    def __init__(self, products=()):
+        self._by_id = {}
+        self._by_name = {}
+        self._in_stock = {}
+        self._available = None
+        # Bumped whenever the set of in-stock products changes
+        self.version = 0
+        for product in products:
+            self.upsert(product)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def get(self, product_id):
+        return self._by_id.get(product_id)
+
+    def find_by_name(self, name):
+        return self._by_name.get(name)
+
+    def is_available(self, product_id):
+        return product_id in self._in_stock
+
+    def available(self):
+        if self._available is None:
+            self._available = [self._in_stock[pid] for pid in sorted(self._in_stock)]
+        return self._available
+
+    def upsert(self, product):
+        product = dict(product)
+        old = self._by_id.get(product["id"])
+        if old is not None and old["name"] != product["name"]:
+            self._by_name.pop(old["name"], None)
+        self._by_id[product["id"]] = product
+        self._by_name[product["name"]] = product
+        self._in_stock.pop(product["id"], None)
+        if product["stock"] > 0:
+            self._in_stock[product["id"]] = product
+        self._available = None
+        self.version += 1
+        return product
+
+    def set_stock(self, product_id, stock):
+        product = self._by_id.get(product_id)
+        if product is None:
+            return None
+        product["stock"] = stock
+        self._update_stock_index(product)
+        return product
+
+    def _update_stock_index(self, product):
+        in_stock = product["stock"] > 0
+        if in_stock == (product["id"] in self._in_stock):
+            return
+        if in_stock:
+            self._in_stock[product["id"]] = product
+        else:
+            del self._in_stock[product["id"]]
+        self._available = None
+        self.version += 1
+
+    def sync(self, products):
+        # Refresh from the database, e.g. when other processes sell stock.
+        # Unchanged products are left alone so the keyboards stay cached.
+        changed = 0
+        for product in products:
+            old = self._by_id.get(product["id"])
+            if old is None or old["name"] != product["name"] or old["link"] != product["link"]:
+                self.upsert(product)
+                changed += 1
+            elif old["stock"] != product["stock"]:
+                self.set_stock(product["id"], product["stock"])
+                changed += 1
+        return changed
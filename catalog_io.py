@@ -0,0 +1,120 @@
+import io
+import os
+import csv
+import json
+import tempfile
+from datetime import datetime
+
+from db import iter_products
+from catalog_reload import validate_products
+
+# ================= SETTINGS =================
+# Bots can only download files up to 20 MB from Telegram
+IMPORT_MAX_SIZE = 20 * 1024 * 1024
+# Exports stay in memory up to this size, then spill to a temp file
+CATALOG_SPOOL_SIZE = 8 * 1024 * 1024
+CATALOG_FORMATS = ("csv", "json")
+CSV_COLUMNS = ["name", "link", "stock"]
+
+def document_format(filename):
+    extension = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    return extension if extension in CATALOG_FORMATS else None
+
+# ================= IMPORT =================
+def _csv_stock(value):
+    # Leaves anything that is not a whole number for validate_products to report
+    value = (value or "").strip()
+    if not value:
+        return 0
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+def _read_csv(text):
+    # Excel with a Russian locale saves ";"-separated files
+    header = text.split("\n", 1)[0]
+    delimiter = ";" if header.count(";") > header.count(",") else ","
+    reader = csv.reader(io.StringIO(text, newline=""), delimiter=delimiter)
+    columns = [column.strip().lower() for column in next(reader, [])]
+    if "name" not in columns:
+        return [], [f"Нет колонки name, нужны колонки: {', '.join(CSV_COLUMNS)}"]
+    positions = {column: columns.index(column) for column in CSV_COLUMNS if column in columns}
+
+    items, lines = [], []
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        values = {column: row[i] if i < len(row) else "" for column, i in positions.items()}
+        # Columns missing from the file are left out, so they stay unchanged
+        item = {"name": values["name"]}
+        if "link" in values:
+            item["link"] = values["link"].strip()
+        if "stock" in values:
+            item["stock"] = _csv_stock(values["stock"])
+        items.append(item)
+        lines.append(reader.line_num)
+    return validate_products(items, lines, partial=True)
+
+def parse_products_document(data, fmt):
+    # Runs off the event loop. Returns (products, errors); errors are
+    # numbered by line for CSV and by item for JSON. A product without
+    # "link" or "stock" keeps its current value (see db.upsert_products).
+    try:
+        text = bytes(data).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return [], ["Файл должен быть в кодировке UTF-8."]
+    if fmt == "csv":
+        return _read_csv(text)
+    try:
+        items = json.loads(text)
+    except ValueError as e:
+        return [], [f"Некорректный JSON: {e}"]
+    return validate_products(items, partial=True)
+
+def error_report(errors, filename):
+    # Per-row errors go back to the admin as a text file
+    stem = os.path.splitext(filename or "catalog")[0]
+    return "\n".join(errors).encode("utf-8") + b"\n", f"{stem}_errors.txt"
+
+# ================= EXPORT =================
+class CatalogExport:
+    def __init__(self, buffer, filename, count):
+        self.buffer = buffer
+        self.filename = filename
+        self.count = count
+
+    def close(self):
+        self.buffer.close()
+
+def export_catalog(fmt="csv"):
+    # Writes straight from the cursor into a spooled buffer. The JSON is in
+    # products.json format. Both formats show the live stock and can be
+    # uploaded back: uploads set the stock rather than adding to it.
+    buffer = tempfile.SpooledTemporaryFile(max_size=CATALOG_SPOOL_SIZE)
+    text = io.TextIOWrapper(buffer, encoding="utf-8", newline="")
+    count = 0
+    try:
+        if fmt == "csv":
+            writer = csv.writer(text)
+            writer.writerow(CSV_COLUMNS)
+            for name, link, stock in iter_products():
+                writer.writerow([name, link or "", stock])
+                count += 1
+        else:
+            text.write("[")
+            for name, link, stock in iter_products():
+                text.write(",\n  " if count else "\n  ")
+                text.write(json.dumps({"name": name, "link": link or "", "stock": stock}, ensure_ascii=False))
+                count += 1
+            text.write("\n]\n")
+        text.flush()
+        # Detach so closing the wrapper does not close the buffer
+        text.detach()
+    except Exception:
+        buffer.close()
+        raise
+
+    buffer.seek(0)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return CatalogExport(buffer, f"catalog_{stamp}.{fmt}", count)
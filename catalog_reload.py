@@ -0,0 +1,125 @@
+import os
+import json
+import itertools
+import asyncio
+
+from db import apply_products_file, upsert_products, get_all_products
+from links import canonical_link
+from repository import run_db
+
+# ================= SETTINGS =================
+PRODUCTS_FILE = os.getenv("PRODUCTS_FILE", "products.json")
+# products.json is checked for changes this often (seconds), 0 disables
+CATALOG_WATCH_INTERVAL = int(os.getenv("CATALOG_WATCH_INTERVAL", "5"))
+MAX_REPORTED_ERRORS = 10
+
+# ================= PARSING =================
+def validate_products(items, numbers=None, partial=False):
+    # Returns (products, errors); products are {"name", "link", "stock"}
+    # with links in canonical form. With partial, "link"/"stock" missing
+    # from an item are left out instead of defaulting to ""/0.
+    # Errors are numbered by position unless numbers (e.g. CSV lines) are given.
+    if not isinstance(items, list):
+        return [], ["Ожидается список товаров."]
+    products, errors, seen = [], [], set()
+    for index, item in zip(numbers or itertools.count(1), items):
+        if not isinstance(item, dict):
+            errors.append(f"#{index}: ожидается объект")
+            continue
+        name = item.get("name")
+        link = item.get("link") or ""
+        stock = item.get("stock", 0)
+        if not isinstance(name, str) or not name.strip():
+            errors.append(f"#{index}: нет названия")
+            continue
+        name = name.strip()
+        if name in seen:
+            errors.append(f"#{index} {name}: название повторяется")
+            continue
+        if not isinstance(link, str) or (link and not link.startswith(("http://", "https://"))):
+            errors.append(f"#{index} {name}: некорректная ссылка")
+            continue
+        if isinstance(stock, bool) or not isinstance(stock, int) or stock < 0:
+            errors.append(f"#{index} {name}: остаток должен быть целым числом ≥ 0")
+            continue
+        seen.add(name)
+        product = {"name": name, "link": canonical_link(link), "stock": stock}
+        if partial:
+            for field in ("link", "stock"):
+                if field not in item:
+                    del product[field]
+        products.append(product)
+    return products, errors
+
+def read_products_file(path):
+    # Runs off the event loop. Returns (products, errors).
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            items = json.load(f)
+    except (OSError, ValueError) as e:
+        return [], [f"{path}: {e}"]
+    return validate_products(items)
+
+# ================= RELOADER =================
+class CatalogReloader:
+    # Applies products.json to the database and the in-memory catalog when
+    # the file changes (mtime/size polling) or on /reload. A file with any
+    # invalid product is rejected as a whole.
+    def __init__(self, path=PRODUCTS_FILE):
+        self.path = path
+        self._seen = None
+        self._lock = None
+        self.reloads = 0
+
+    def _get_lock(self):
+        # Created in the running loop: on Python 3.9 a lock binds to the loop
+        # that exists when it is made, and webhook mode and sharded workers
+        # run under a fresh asyncio.run() loop
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def changed(self):
+        signature = self._signature()
+        return signature is not None and signature != self._seen
+
+    async def reload(self, catalog):
+        # Returns a report for the admin
+        async with self._get_lock():
+            signature = self._signature()
+            products, errors = await asyncio.to_thread(read_products_file, self.path)
+            if errors:
+                # Not retried until the file changes again
+                self._seen = signature
+                shown = "\n".join(errors[:MAX_REPORTED_ERRORS])
+                more = len(errors) - MAX_REPORTED_ERRORS
+                return f"❌ {self.path} не загружен, ошибок: {len(errors)}\n{shown}" + (f"\n… и ещё {more}" if more > 0 else "")
+
+            report = await self._apply(catalog, products)
+            self._seen = signature
+            self.reloads += 1
+            return report
+
+    async def apply(self, catalog, products):
+        # Admin uploads: the uploaded stock replaces the live stock, so an
+        # edited /exportcatalog file can be sent back as it is
+        async with self._get_lock():
+            return await self._apply(catalog, products, upsert_products)
+
+    async def _apply(self, catalog, products, upsert=apply_products_file):
+        # One transaction on its own thread, so a 50k-product upsert does
+        # not hold up the DB executor used by buyer-facing handlers
+        added, updated, missing = await asyncio.to_thread(upsert, products)
+        # sync() runs without awaiting, so handlers never see a half-updated catalog
+        changed = catalog.sync(await run_db(get_all_products))
+        report = f"✅ Каталог обновлён: новых {added}, изменено {updated}, в каталоге бота изменилось {changed}"
+        if missing:
+            report += f"\nНет в файле (оставлены как есть): {missing}"
+        return report
@@ -0,0 +1,640 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from links import canonical_link
+from migrations import migrate, rebuild_stats as _rebuild_stats
+
+# ================= SETTINGS =================
+DB_NAME = os.getenv("DB_NAME", "orders.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_TIMEOUT = 30
+# sqlite3 keeps compiled statements per connection, keyed by SQL text.
+# With long-lived connections the cache survives between updates.
+STATEMENT_CACHE_SIZE = 256
+
+# ================= CONNECTION POOL =================
+def _connect():
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=DB_TIMEOUT,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA foreign_keys=ON")
+    return conn
+
+class ConnectionPool:
+    def __init__(self, size=DB_POOL_SIZE):
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Пул соединений закрыт.")
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return _connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        # Pool is exhausted, wait for a connection to come back
+        return self._idle.get()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+            return
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
+
+@contextmanager
+def get_connection():
+    # Borrow a pooled connection for one transaction: commit on success,
+    # rollback on error, then hand the connection back to the pool.
+    with get_pool().connection() as conn:
+        with conn:
+            yield conn
+
+# ================= SCHEMA =================
+def init_db():
+    with get_pool().connection() as conn:
+        migrate(conn)
+
+# ================= PRODUCTS =================
+PRODUCT_COLUMNS = "id, name, link, stock"
+
+def _product_from_row(row):
+    if row is None:
+        return None
+    return {"id": row[0], "name": row[1], "link": row[2], "stock": row[3]}
+
+def count_products():
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+def import_products(items):
+    # Upsert by name, so re-importing products.json updates links and stock.
+    # Links are stored in canonical form (see links.py).
+    with get_connection() as conn:
+        conn.executemany("""
+            INSERT INTO products (name, link, stock, source_stock)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET link=excluded.link, stock=excluded.stock, source_stock=excluded.stock
+        """, [(p["name"], canonical_link(p.get("link")), int(p.get("stock", 0)), int(p.get("stock", 0))) for p in items])
+        _link_orders(conn)
+        return len(items)
+
+def _link_orders(conn):
+    # Orders saved before their product was in the table (e.g. orders.db
+    # upgraded by init_db() before seed_products) get their product_id, and
+    # drop their own product_link where it matches the product's
+    conn.execute("""
+        UPDATE orders SET product_id = (SELECT id FROM products WHERE products.name = orders.product_name)
+        WHERE product_id IS NULL
+    """)
+    conn.execute("""
+        UPDATE orders SET product_link = NULLIF(
+            product_link,
+            (SELECT link FROM products WHERE products.id = orders.product_id)
+        )
+        WHERE product_id IS NOT NULL AND product_link IS NOT NULL
+    """)
+
+def apply_products_file(items):
+    # Hot reload of products.json. The file's stock is the admin's count;
+    # units sold or held since the last load stay deducted, so only the
+    # change in the file is applied. The first load of a product sets the
+    # baseline. Returns (added, updated, not in file).
+    with get_connection() as conn:
+        existing = {
+            row[0]: (row[1], row[2])
+            for row in conn.execute("SELECT name, link, source_stock FROM products")
+        }
+        # Only new and changed products are written
+        changed, added = [], 0
+        for p in items:
+            old = existing.pop(p["name"], None)
+            if old is None:
+                added += 1
+            elif old == (p["link"], p["stock"]):
+                continue
+            changed.append((p["name"], p["link"], p["stock"], p["stock"]))
+        conn.executemany("""
+            INSERT INTO products (name, link, stock, source_stock)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET
+                link=excluded.link,
+                stock=MAX(0, stock + excluded.source_stock - COALESCE(source_stock, excluded.source_stock)),
+                source_stock=excluded.source_stock
+        """, changed)
+        return added, len(changed) - added, len(existing)
+
+def upsert_products(items):
+    # Admin uploads (see catalog_io.py). Unlike products.json, the stock in
+    # the upload is the live stock, as /exportcatalog shows it. "link" or
+    # "stock" missing from an item keep the current value. source_stock is
+    # left alone, so later products.json edits still apply as a change.
+    # Returns (added, updated, not in upload).
+    with get_connection() as conn:
+        existing = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT name, link, stock FROM products")}
+        # Only new and changed products are written
+        changed, added = [], 0
+        for p in items:
+            old = existing.pop(p["name"], None)
+            if old is None:
+                added += 1
+                changed.append((p["name"], p.get("link", ""), p.get("stock", 0)))
+                continue
+            new = (p.get("link", old[0]), p.get("stock", old[1]))
+            if new != old:
+                changed.append((p["name"],) + new)
+        conn.executemany("""
+            INSERT INTO products (name, link, stock) VALUES (?, ?, ?)
+            ON CONFLICT(name) DO UPDATE SET link=excluded.link, stock=excluded.stock
+        """, changed)
+        return added, len(changed) - added, len(existing)
+
+def export_products():
+    # Writes the live stock into products.json (sync_products.py export), so
+    # it becomes the new baseline: the hot reload must not deduct units sold
+    # before the export a second time.
+    with get_connection() as conn:
+        conn.execute("UPDATE products SET source_stock = stock WHERE source_stock IS NOT stock")
+        cursor = conn.execute("SELECT name, link, stock FROM products ORDER BY id")
+        return [{"name": row[0], "link": row[1], "stock": row[2]} for row in cursor]
+
+def iter_products(chunk_size=1000):
+    # Streams the catalog for export in chunks instead of one fetchall()
+    with get_connection() as conn:
+        cursor = conn.execute("SELECT name, link, stock FROM products ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+def get_product(product_id):
+    with get_connection() as conn:
+        cursor = conn.execute(f"SELECT {PRODUCT_COLUMNS} FROM products WHERE id=?", (product_id,))
+        return _product_from_row(cursor.fetchone())
+
+def get_all_products():
+    with get_connection() as conn:
+        cursor = conn.execute(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id")
+        return [_product_from_row(row) for row in cursor]
+
+# ================= ORDERS =================
+def save_order(user_id, data):
+    # Turns the buyer's stock hold (see reserve) into an order; without a
+    # matching hold the stock is taken here. The stock change and the order
+    # row commit or roll back together. Returns the new order id and the
+    # remaining stock of the product.
+    with get_connection() as conn:
+        held = conn.execute(
+            "DELETE FROM reservations WHERE user_id=? RETURNING product_id, quantity", (user_id,)
+        ).fetchone()
+        if held == (data["product_id"], data["quantity"]):
+            remaining = conn.execute("SELECT stock FROM products WHERE id=?", (data["product_id"],)).fetchone()[0]
+        else:
+            if held:
+                _return_stock(conn, [held])
+            remaining = _take_stock(conn, data["product_id"], data["quantity"])
+
+        # The link is read from products through product_id
+        cursor = conn.execute("""
+            INSERT INTO orders
+            (user_id, product_id, product_name, quantity, customer_name, order_number)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (
+            user_id,
+            data["product_id"],
+            data["product_name"],
+            data["quantity"],
+            data["customer_name"],
+            data["order_number"]
+        ))
+        return cursor.lastrowid, remaining
+
+def cancel_order(user_id, order_id):
+    # Deletes an order the buyer cancelled before paying and returns its
+    # stock. Returns [(product_id, stock)] of the products that changed, or
+    # None if there was no such unpaid order.
+    with get_connection() as conn:
+        row = conn.execute("""
+            DELETE FROM orders
+            WHERE id=? AND user_id=? AND payment_method IS NULL AND review_sent=0
+            RETURNING product_id, quantity
+        """, (order_id, user_id)).fetchone()
+        if row is None:
+            return None
+        return _return_stock(conn, [row])
+
+def update_payment(order_id, method, info):
+    with get_connection() as conn:
+        conn.execute("""
+            UPDATE orders
+            SET payment_method=?, payment_info=?
+            WHERE id=?
+        """, (method, info, order_id))
+
+def get_user_orders(user_id):
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT id, product_name, quantity, created_at
+            FROM orders
+            WHERE user_id=?
+            ORDER BY created_at DESC
+        """, (user_id,))
+        return cursor.fetchall()
+
+def get_latest_pending_order(user_id, exclude_ids=()):
+    # exclude_ids: orders whose screenshot is already being saved
+    exclude_ids = list(exclude_ids)
+    exclude = f"AND id NOT IN ({','.join('?' * len(exclude_ids))})" if exclude_ids else ""
+    with get_connection() as conn:
+        cursor = conn.execute(f"""
+            SELECT id FROM orders
+            WHERE user_id=? AND review_sent=0 {exclude}
+            ORDER BY created_at DESC LIMIT 1
+        """, (user_id, *exclude_ids))
+        return cursor.fetchone()
+
+def get_pending_review_batch(after_user_id, limit):
+    # Next `limit` users with orders waiting for a review screenshot, as
+    # [(user_id, [product_name, ...]), ...]. Walks the partial review index
+    # by user_id, so the caller can stream through all pending users.
+    with get_connection() as conn:
+        user_ids = [row[0] for row in conn.execute("""
+            SELECT DISTINCT user_id FROM orders
+            WHERE review_sent=0 AND user_id > ?
+            ORDER BY user_id LIMIT ?
+        """, (after_user_id, limit))]
+        if not user_ids:
+            return []
+
+        batch = {user_id: [] for user_id in user_ids}
+        cursor = conn.execute("""
+            SELECT user_id, product_name FROM orders
+            WHERE review_sent=0 AND user_id BETWEEN ? AND ?
+            ORDER BY user_id, id
+        """, (user_ids[0], user_ids[-1]))
+        for user_id, product_name in cursor:
+            if product_name not in batch[user_id]:
+                batch[user_id].append(product_name)
+        return list(batch.items())
+
+# Orders keep their own product_link only where it differs from the product's
+ORDER_EXPORT_COLUMNS = """
+    orders.id, user_id, product_name, COALESCE(product_link, products.link), quantity, customer_name,
+    order_number, payment_method, payment_info, review_sent, created_at
+"""
+
+def iter_orders(date_from=None, date_to=None, after_id=None, chunk_size=1000):
+    # Streams orders for export in chunks instead of one fetchall().
+    # date_from is inclusive, date_to exclusive ("YYYY-MM-DD").
+    conditions, params = [], []
+    if date_from:
+        conditions.append("orders.created_at >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("orders.created_at < ?")
+        params.append(date_to)
+    if after_id:
+        conditions.append("orders.id > ?")
+        params.append(after_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with get_connection() as conn:
+        cursor = conn.execute(f"""
+            SELECT {ORDER_EXPORT_COLUMNS}
+            FROM orders
+            LEFT JOIN products ON products.id = orders.product_id
+            {where}
+            ORDER BY created_at DESC
+        """, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+def get_last_export_id(name):
+    with get_connection() as conn:
+        row = conn.execute("SELECT last_order_id FROM export_state WHERE name=?", (name,)).fetchone()
+        return row[0] if row else 0
+
+def set_last_export_id(name, order_id):
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO export_state (name, last_order_id, exported_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(name) DO UPDATE SET
+                last_order_id=MAX(last_order_id, excluded.last_order_id),
+                exported_at=excluded.exported_at
+        """, (name, order_id))
+
+# ================= RESERVATIONS =================
+def _take_stock(conn, product_id, quantity):
+    rows = conn.execute(
+        "UPDATE products SET stock = stock - ? WHERE id=? AND stock >= ? RETURNING stock",
+        (quantity, product_id, quantity)
+    ).fetchall()
+    if not rows:
+        row = conn.execute("SELECT stock FROM products WHERE id=?", (product_id,)).fetchone()
+        if row is None:
+            raise ValueError("Продукт не найден при сохранении заказа.")
+        raise ValueError(f"Недостаточно товара на складе. Доступно: {row[0]} шт.")
+    return rows[0][0]
+
+def _return_stock(conn, holds):
+    # holds: [(product_id, quantity)], summed per product so a bulk release
+    # is one UPDATE per product. Returns [(product_id, stock)].
+    totals = {}
+    for product_id, quantity in holds:
+        totals[product_id] = totals.get(product_id, 0) + quantity
+    changed = []
+    for product_id, quantity in totals.items():
+        row = conn.execute(
+            "UPDATE products SET stock = stock + ? WHERE id=? RETURNING id, stock", (quantity, product_id)
+        ).fetchone()
+        if row:
+            changed.append(row)
+    return changed
+
+def reserve(user_id, product_id, quantity, ttl):
+    # Holds stock for a buyer for `ttl` seconds, replacing their previous
+    # hold. Raises ValueError if there is not enough.
+    # Returns [(product_id, stock)] of the products that changed.
+    with get_connection() as conn:
+        held = conn.execute(
+            "DELETE FROM reservations WHERE user_id=? RETURNING product_id, quantity", (user_id,)
+        ).fetchall()
+        changed = dict(_return_stock(conn, held))
+        changed[product_id] = _take_stock(conn, product_id, quantity)
+        conn.execute("""
+            INSERT INTO reservations (user_id, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)
+        """, (user_id, product_id, quantity, time.time() + ttl))
+        return list(changed.items())
+
+def release_reservation(user_id):
+    with get_connection() as conn:
+        held = conn.execute(
+            "DELETE FROM reservations WHERE user_id=? RETURNING product_id, quantity", (user_id,)
+        ).fetchall()
+        return _return_stock(conn, held)
+
+def reap_reservations(limit=1000):
+    # Releases up to `limit` expired holds, oldest first, in one transaction.
+    # Returns (holds released, [(product_id, stock)]).
+    with get_connection() as conn:
+        held = conn.execute("""
+            DELETE FROM reservations WHERE id IN (
+                SELECT id FROM reservations WHERE expires_at <= ? ORDER BY expires_at LIMIT ?
+            ) RETURNING product_id, quantity
+        """, (time.time(), limit)).fetchall()
+        return len(held), _return_stock(conn, held)
+
+def count_reservations():
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM reservations").fetchone()
+
+# ================= REVIEW STORE =================
+def get_review_blob_by_file(file_unique_id):
+    with get_connection() as conn:
+        row = conn.execute(
+            "SELECT sha256 FROM review_files WHERE file_unique_id=?", (file_unique_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+def save_review(order_id, sha256, file_unique_id=None, path=None, size=None, file_id=None):
+    # Attaches a stored blob to an order and marks the review as sent.
+    # path/size are only needed the first time a blob is seen.
+    with get_connection() as conn:
+        if path is not None:
+            # A blob stored again after its original was evicted is whole again
+            conn.execute("""
+                INSERT INTO review_blobs (sha256, path, size) VALUES (?, ?, ?)
+                ON CONFLICT(sha256) DO UPDATE SET evicted_at=NULL
+            """, (sha256, path, size))
+        if file_id is not None:
+            conn.execute(
+                "UPDATE review_blobs SET telegram_file_id=? WHERE sha256=? AND telegram_file_id IS NULL",
+                (file_id, sha256),
+            )
+        if file_unique_id is not None:
+            conn.execute(
+                "INSERT OR IGNORE INTO review_files (file_unique_id, sha256) VALUES (?, ?)",
+                (file_unique_id, sha256),
+            )
+        conn.execute("""
+            INSERT INTO order_reviews (order_id, sha256, file_unique_id) VALUES (?, ?, ?)
+            ON CONFLICT(order_id) DO UPDATE SET sha256=excluded.sha256, file_unique_id=excluded.file_unique_id
+        """, (order_id, sha256, file_unique_id))
+        conn.execute("UPDATE orders SET review_sent=1 WHERE id=?", (order_id,))
+
+def save_review_variants(sha256, variants):
+    # variants: [(kind, path, size, width, height)]
+    with get_connection() as conn:
+        conn.executemany("""
+            INSERT INTO review_variants (sha256, kind, path, size, width, height)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(sha256, kind) DO UPDATE SET
+                path=excluded.path, size=excluded.size, width=excluded.width, height=excluded.height
+        """, [(sha256, *variant) for variant in variants])
+
+def get_review_blobs_without_variants(kind, limit=100):
+    with get_connection() as conn:
+        return conn.execute("""
+            SELECT b.sha256, b.path FROM review_blobs b
+            WHERE b.evicted_at IS NULL
+              AND NOT EXISTS (SELECT 1 FROM review_variants v WHERE v.sha256 = b.sha256 AND v.kind = ?)
+            LIMIT ?
+        """, (kind, limit)).fetchall()
+
+def get_review_blobs_to_evict(kind, before, limit=500):
+    # Originals older than `before` that already have a `kind` copy
+    with get_connection() as conn:
+        return conn.execute("""
+            SELECT b.sha256, b.path FROM review_blobs b
+            JOIN review_variants v ON v.sha256 = b.sha256 AND v.kind = ?
+            WHERE b.evicted_at IS NULL AND b.created_at < ?
+            LIMIT ?
+        """, (kind, before, limit)).fetchall()
+
+def mark_review_blobs_evicted(sha256s):
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE review_blobs SET evicted_at=CURRENT_TIMESTAMP WHERE sha256=?",
+            [(sha,) for sha in sha256s],
+        )
+
+REVIEW_GALLERY_COLUMNS = """
+    r.order_id, o.user_id, o.product_name, o.customer_name, r.created_at,
+    b.sha256, b.path, b.evicted_at IS NOT NULL, b.telegram_file_id
+"""
+
+def get_recent_reviews(limit, unviewed_only=False):
+    # Newest screenshots first, for the admin gallery
+    where = "WHERE r.viewed_at IS NULL" if unviewed_only else ""
+    with get_connection() as conn:
+        return conn.execute(f"""
+            SELECT {REVIEW_GALLERY_COLUMNS}
+            FROM order_reviews r
+            JOIN orders o ON o.id = r.order_id
+            JOIN review_blobs b ON b.sha256 = r.sha256
+            {where}
+            ORDER BY r.order_id DESC
+            LIMIT ?
+        """, (limit,)).fetchall()
+
+def get_reviews_for_orders(order_ids):
+    order_ids = list(order_ids)
+    if not order_ids:
+        return []
+    with get_connection() as conn:
+        return conn.execute(f"""
+            SELECT {REVIEW_GALLERY_COLUMNS}
+            FROM order_reviews r
+            JOIN orders o ON o.id = r.order_id
+            JOIN review_blobs b ON b.sha256 = r.sha256
+            WHERE r.order_id IN ({','.join('?' * len(order_ids))})
+            ORDER BY r.order_id DESC
+        """, order_ids).fetchall()
+
+def set_review_file_ids(pairs):
+    # pairs: [(sha256, telegram_file_id)]
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE review_blobs SET telegram_file_id=? WHERE sha256=?",
+            [(file_id, sha) for sha, file_id in pairs],
+        )
+
+def mark_reviews_viewed(order_ids):
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE order_reviews SET viewed_at=CURRENT_TIMESTAMP WHERE order_id=? AND viewed_at IS NULL",
+            [(order_id,) for order_id in order_ids],
+        )
+
+# ================= OUTBOX =================
+def spool_outbox(method, chat_id, payload, priority, next_attempt_at, error=None):
+    with get_connection() as conn:
+        conn.execute("""
+            INSERT INTO outbox (method, chat_id, payload, priority, next_attempt_at, last_error)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (method, chat_id, payload, priority, next_attempt_at, error))
+
+def get_due_outbox(now, limit=100):
+    # Highest priority first among the calls that are due
+    with get_connection() as conn:
+        return conn.execute("""
+            SELECT id, method, chat_id, payload, priority, attempts FROM outbox
+            WHERE next_attempt_at <= ?
+            ORDER BY priority, id
+            LIMIT ?
+        """, (now, limit)).fetchall()
+
+def reschedule_outbox(rows):
+    # rows: [(next_attempt_at, error, id)]
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE outbox SET attempts=attempts+1, next_attempt_at=?, last_error=? WHERE id=?", rows
+        )
+
+def delete_outbox(ids):
+    with get_connection() as conn:
+        conn.executemany("DELETE FROM outbox WHERE id=?", [(row_id,) for row_id in ids])
+
+def count_outbox():
+    with get_connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+# ================= STATS =================
+# Counters in order_stats are maintained by triggers (see migrations.py)
+def get_stats():
+    with get_connection() as conn:
+        row = conn.execute("SELECT orders, units FROM order_stats WHERE kind='total' AND key=''").fetchone()
+        return row if row else (0, 0)
+
+def get_payment_counts():
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT key, orders FROM order_stats
+            WHERE kind='payment' AND orders > 0
+            ORDER BY orders DESC
+        """)
+        return cursor.fetchall()
+
+def get_product_stats(limit=10):
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT key, orders, units FROM order_stats
+            WHERE kind='product' AND orders > 0
+            ORDER BY units DESC LIMIT ?
+        """, (limit,))
+        return cursor.fetchall()
+
+def get_daily_stats(since_day):
+    with get_connection() as conn:
+        cursor = conn.execute("""
+            SELECT key, orders, units FROM order_stats
+            WHERE kind='day' AND key >= ?
+            ORDER BY key
+        """, (since_day,))
+        return cursor.fetchall()
+
+def rebuild_stats():
+    with get_connection() as conn:
+        _rebuild_stats(conn)
@@ -0,0 +1,114 @@
+import io
+import csv
+import gzip
+import tempfile
+from datetime import datetime, timedelta
+
+from db import iter_orders, get_last_export_id, set_last_export_id
+
+# ================= SETTINGS =================
+# Exports stay in memory up to this size, then spill to a temp file
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+EXPORT_STATE_NAME = "allorders"
+
+CSV_HEADER = [
+    "ID", "User ID", "Quantity", "Customer Name", "Order Number",
+    "Payment Method", "Payment Info", "Review Sent", "Created At",
+    "Product Name", "Product Link"
+]
+
+def format_order_row(order):
+    # Product Name and Link go at the end
+    return [
+        order[0],  # ID
+        order[1],  # User ID
+        order[4],  # Quantity
+        order[5] or "—",  # Customer Name
+        order[6] or "—",  # Order Number
+        order[7] or "—",  # Payment Method
+        order[8] or "—",  # Payment Info
+        "✅" if order[9] else "❌",  # Review Sent
+        order[10],  # Created At
+        order[2],  # Product Name
+        order[3],  # Product Link
+    ]
+
+# ================= EXPORT =================
+class OrdersExport:
+    def __init__(self, buffer, filename, count, last_order_id, advances_cursor=False):
+        self.buffer = buffer
+        self.filename = filename
+        self.count = count
+        self.last_order_id = last_order_id
+        # Only "/allorders new" without dates moves the "since last export" cursor
+        self.advances_cursor = advances_cursor
+
+    def close(self):
+        self.buffer.close()
+
+def export_orders_csv(date_from=None, date_to=None, since_last=False, compress=False):
+    # Writes the CSV straight into a spooled buffer while the cursor is
+    # read, so memory use does not grow with the order history.
+    after_id = get_last_export_id(EXPORT_STATE_NAME) if since_last else None
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    raw = gzip.GzipFile(fileobj=buffer, mode="wb") if compress else buffer
+    text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+    writer = csv.writer(text)
+    writer.writerow(CSV_HEADER)
+
+    count, last_order_id = 0, 0
+    try:
+        for order in iter_orders(date_from, date_to, after_id):
+            writer.writerow(format_order_row(order))
+            count += 1
+            last_order_id = max(last_order_id, order[0])
+        text.flush()
+        # Detach so closing the wrapper does not close the buffer
+        text.detach()
+        if compress:
+            raw.close()
+    except Exception:
+        buffer.close()
+        raise
+
+    if count == 0:
+        buffer.close()
+        return None
+
+    buffer.seek(0)
+    stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = f"orders_{stamp}.csv" + (".gz" if compress else "")
+    advances_cursor = since_last and not date_from and not date_to
+    return OrdersExport(buffer, filename, count, last_order_id, advances_cursor)
+
+def mark_exported(export):
+    # A date range can skip older orders that were never exported, so it
+    # must not move the cursor past them
+    if not export.advances_cursor:
+        return
+    set_last_export_id(EXPORT_STATE_NAME, export.last_order_id)
+
+def parse_export_args(args):
+    # /allorders [new] [gz] [YYYY-MM-DD [YYYY-MM-DD]]
+    options = {"date_from": None, "date_to": None, "since_last": False, "compress": False}
+    dates = []
+    for arg in args:
+        lowered = arg.lower()
+        if lowered in ("new", "since"):
+            options["since_last"] = True
+        elif lowered in ("gz", "gzip"):
+            options["compress"] = True
+        else:
+            try:
+                dates.append(datetime.strptime(arg, "%Y-%m-%d"))
+            except ValueError:
+                raise ValueError(f"Непонятный параметр: {arg}")
+    if len(dates) > 2:
+        raise ValueError("Укажите не больше двух дат: с какого и по какое число.")
+    if dates:
+        options["date_from"] = dates[0].strftime("%Y-%m-%d")
+    if len(dates) == 2:
+        # The end date is inclusive
+        options["date_to"] = (dates[1] + timedelta(days=1)).strftime("%Y-%m-%d")
+    return options
@@ -0,0 +1,133 @@
+import os
+import time
+from enum import Enum
+
+# ================= SETTINGS =================
+# A buyer who stops halfway through the order form starts over after this
+# long; see FlowEngine timeouts
+FLOW_STEP_TIMEOUT = int(os.getenv("FLOW_STEP_TIMEOUT", str(24 * 3600)))
+
+# ================= STATES AND EVENTS =================
+class State(Enum):
+    # Where a buyer is in the order flow, stored in their session
+    IDLE = "idle"
+    QUANTITY = "quantity"
+    CUSTOMER_NAME = "customer_name"
+    ORDER_NUMBER = "order_number"
+    PAYMENT_METHOD = "payment_method"
+    PAYMENT_INFO = "payment_info"
+
+class Event(Enum):
+    TEXT = "text"
+    PHOTO = "photo"
+    PRODUCT = "product"
+    PAGE = "page"
+    PAYMENT = "payment"
+    CANCEL = "cancel"
+    NOOP = "noop"
+    UNKNOWN = "unknown"
+
+# Matches any state in a transition table key
+ANY = None
+
+def infer_state(fields):
+    # Sessions saved before states existed only have the collected fields
+    if fields.get("product_name") is None:
+        return State.IDLE
+    for name, state in (
+        ("quantity", State.QUANTITY),
+        ("customer_name", State.CUSTOMER_NAME),
+        ("order_number", State.ORDER_NUMBER),
+    ):
+        if fields.get(name) is None:
+            return state
+    return State.PAYMENT_INFO if fields.get("awaiting_payment_info") else State.PAYMENT_METHOD
+
+# ================= VALIDATION =================
+class Invalid(Exception):
+    # Raised by a validator; the message is sent back to the buyer
+    pass
+
+def positive_int(session, text):
+    if not text.isdigit() or int(text) <= 0:
+        raise Invalid("Введите положительное число.")
+    return int(text)
+
+def max_length(limit):
+    def validate(session, text):
+        if len(text) > limit:
+            raise Invalid(f"Слишком длинный ответ, не более {limit} символов.")
+        return text
+    return validate
+
+def all_of(*validators):
+    # Runs validators in order, each gets the previous one's value
+    def validate(session, value):
+        for validator in validators:
+            value = validator(session, value)
+        return value
+    return validate
+
+# ================= STEPS =================
+class Step:
+    # One transition: validate(session, payload) -> value or Invalid, then
+    # handler(update, context, session, value) -> next State or None.
+    # None keeps `next_state` (or the current state if that is None too).
+    __slots__ = ("handler", "validate", "next_state")
+
+    def __init__(self, handler, validate=None, next_state=None):
+        self.handler = handler
+        self.validate = validate
+        self.next_state = next_state
+
+def field_step(field, prompt, next_state, validate=None):
+    # Step that stores the validated text in a session field and asks the
+    # next question, for form-like steps with no logic of their own
+    async def handler(update, context, session, value):
+        setattr(session, field, value)
+        await update.effective_message.reply_text(prompt)
+    return Step(handler, validate, next_state)
+
+# ================= ENGINE =================
+class FlowEngine:
+    # Table-driven dispatch: one dict lookup per update for (state, event),
+    # then (ANY, event). Updates with no transition get the state's prompt.
+    def __init__(self, steps, prompts=None, timeouts=None, on_timeout=None):
+        self.steps = dict(steps)
+        self.prompts = prompts or {}
+        self.timeouts = timeouts or {}
+        self.on_timeout = on_timeout
+
+    def add(self, state, event, step):
+        self.steps[(state, event)] = step
+
+    async def dispatch(self, update, context, session, event, payload=None):
+        state = session.state
+        limit = self.timeouts.get(state)
+        if limit is not None and session.state_at is not None and time.time() - session.state_at > limit:
+            session = await self.on_timeout(update, context, session)
+            state = session.state
+
+        step = self.steps.get((state, event)) or self.steps.get((ANY, event))
+        if step is None:
+            prompt = self.prompts.get(state)
+            if prompt:
+                await update.effective_message.reply_text(prompt)
+            return session
+
+        value = payload
+        if step.validate is not None:
+            try:
+                value = step.validate(session, payload)
+            except Invalid as e:
+                await update.effective_message.reply_text(str(e))
+                return session
+
+        next_state = await step.handler(update, context, session, value) or step.next_state
+        if next_state is not None and next_state is not session.state:
+            move_to(session, next_state)
+        return session
+
+def move_to(session, state):
+    session.state = state
+    session.state_at = time.time()
@@ -0,0 +1,93 @@
+import os
+import asyncio
+
+from telegram import InputMediaPhoto
+
+from db import get_recent_reviews, get_reviews_for_orders, set_review_file_ids, mark_reviews_viewed
+from repository import run_db
+from reviews import REVIEWS_DIR, variant_path
+
+# ================= SETTINGS =================
+# Telegram accepts 2-10 photos per media group
+MEDIA_GROUP_SIZE = 10
+REVIEW_GALLERY_DEFAULT = 10
+REVIEW_GALLERY_MAX = 30
+
+# ================= QUERY =================
+def parse_gallery_args(args):
+    # /reviews            newest screenshots the admin has not seen yet
+    # /reviews all        newest screenshots
+    # /reviews 12 15 ...  screenshots of these orders
+    if not args:
+        return {"unviewed_only": True}
+    if len(args) == 1 and args[0].lower() == "all":
+        return {"unviewed_only": False}
+    try:
+        order_ids = [int(arg.lstrip("#")) for arg in args]
+    except ValueError:
+        raise ValueError("Используйте: /reviews, /reviews all или /reviews <ID заказа> ...")
+    return {"order_ids": order_ids[:REVIEW_GALLERY_MAX]}
+
+def load_gallery(unviewed_only=False, order_ids=None):
+    if order_ids:
+        return get_reviews_for_orders(order_ids)
+    return get_recent_reviews(REVIEW_GALLERY_DEFAULT, unviewed_only)
+
+# ================= SENDING =================
+def _caption(review):
+    order_id, user_id, product_name, customer_name, created_at = review[:5]
+    return f"Заказ {order_id} · {product_name}\n{customer_name or '—'} ({user_id}) · {created_at}"
+
+def _local_file(review):
+    # Smallest file worth showing: the archive copy, or the original if
+    # there is none yet. None if neither is on disk.
+    path, evicted = review[6], review[7]
+    for candidate in (variant_path(path, "archive"), None if evicted else path):
+        if candidate and os.path.exists(os.path.join(REVIEWS_DIR, candidate)):
+            return os.path.join(REVIEWS_DIR, candidate)
+    return None
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+async def send_review_gallery(bot, chat_id, reviews):
+    # Sends screenshots as albums of up to 10. Photos Telegram already has
+    # go by file_id; the rest are uploaded once and their file_id cached.
+    # Returns (sent order ids, order ids without a file).
+    sent, missing = [], []
+    items = []
+    for review in reviews:
+        file_id = review[8]
+        if file_id:
+            items.append((review, file_id, False))
+            continue
+        path = _local_file(review)
+        if path is None:
+            missing.append(review[0])
+            continue
+        items.append((review, await asyncio.to_thread(_read, path), True))
+
+    for start in range(0, len(items), MEDIA_GROUP_SIZE):
+        chunk = items[start:start + MEDIA_GROUP_SIZE]
+        media = [InputMediaPhoto(photo, caption=_caption(review)) for review, photo, _ in chunk]
+        if len(media) == 1:
+            # A media group needs at least two items
+            message = await bot.send_photo(chat_id=chat_id, photo=media[0].media, caption=media[0].caption)
+            messages = [message]
+        else:
+            # RetryAfter is waited out by the bot's rate limiter
+            messages = await bot.send_media_group(chat_id=chat_id, media=media)
+
+        uploaded = [
+            (review[5], message.photo[-1].file_id)
+            for (review, _, is_upload), message in zip(chunk, messages)
+            if is_upload and message.photo
+        ]
+        if uploaded:
+            await run_db(set_review_file_ids, uploaded)
+        sent.extend(review[0] for review, _, _ in chunk)
+
+    if sent:
+        await run_db(mark_reviews_viewed, sent)
+    return sent, missing
@@ -0,0 +1,92 @@
+import string
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+# ================= CALLBACK DATA =================
+# Telegram limits callback_data to 64 bytes, so buttons carry a short
+# base62 product id ("p:1A") instead of the product name.
+PRODUCT_PREFIX = "p:"
+PAGE_PREFIX = "pg:"
+NOOP = "noop"
+
+BASE62 = string.digits + string.ascii_uppercase + string.ascii_lowercase
+_BASE62_INDEX = {c: i for i, c in enumerate(BASE62)}
+
+def encode_id(number):
+    if number < 0:
+        raise ValueError("ID должен быть неотрицательным.")
+    if number == 0:
+        return BASE62[0]
+    digits = []
+    while number:
+        number, rem = divmod(number, 62)
+        digits.append(BASE62[rem])
+    return "".join(reversed(digits))
+
+def decode_id(text):
+    number = 0
+    for c in text:
+        if c not in _BASE62_INDEX:
+            raise ValueError(f"Некорректный ID: {text}")
+        number = number * 62 + _BASE62_INDEX[c]
+    return number
+
+def product_callback(product_id):
+    return PRODUCT_PREFIX + encode_id(product_id)
+
+def parse_product_callback(data):
+    try:
+        return decode_id(data[len(PRODUCT_PREFIX):])
+    except ValueError:
+        return None
+
+def parse_page_callback(data):
+    try:
+        return int(data[len(PAGE_PREFIX):])
+    except ValueError:
+        return 0
+
+# ================= CATALOG PAGES =================
+class CatalogKeyboards:
+    # Pre-rendered catalog pages. The cache is dropped only when the catalog
+    # version changes, i.e. when a product goes in or out of stock.
+    def __init__(self, catalog, page_size=8):
+        self.catalog = catalog
+        self.page_size = page_size
+        self._pages = {}
+        self._version = None
+
+    def page_count(self):
+        available = len(self.catalog.available())
+        return max(1, -(-available // self.page_size))
+
+    def page(self, number):
+        if self._version != self.catalog.version:
+            self._pages = {}
+            self._version = self.catalog.version
+
+        pages = self.page_count()
+        number = min(max(number, 0), pages - 1)
+        markup = self._pages.get(number)
+        if markup is None:
+            markup = self._pages[number] = self._build(number, pages)
+        return markup
+
+    def _build(self, number, pages):
+        start = number * self.page_size
+        items = self.catalog.available()[start:start + self.page_size]
+        keyboard = [
+            [InlineKeyboardButton(p["name"], callback_data=product_callback(p["id"]))]
+            for p in items
+        ]
+
+        if pages > 1:
+            nav = []
+            if number > 0:
+                nav.append(InlineKeyboardButton("◀️", callback_data=f"{PAGE_PREFIX}{number - 1}"))
+            nav.append(InlineKeyboardButton(f"{number + 1}/{pages}", callback_data=NOOP))
+            if number < pages - 1:
+                nav.append(InlineKeyboardButton("▶️", callback_data=f"{PAGE_PREFIX}{number + 1}"))
+            keyboard.append(nav)
+
+        return InlineKeyboardMarkup(keyboard)
@@ -0,0 +1,34 @@
+import re
+from urllib.parse import urlsplit
+
+# ================= PRODUCT LINKS =================
+# Links pasted from Amazon search results carry hundreds of bytes of
+# tracking parameters. Everything needed to open the product is the ASIN,
+# so links are stored as https://www.amazon.<tld>/dp/<ASIN>.
+# Short links (a.co, amzn.to) and other shops are kept as they are.
+
+ASIN_PATTERN = re.compile(
+    r"/(?:dp|gp/product|gp/aw/d|exec/obidos/ASIN|o/ASIN|product-reviews)/([A-Z0-9]{10})(?:[/?#]|$)",
+    re.IGNORECASE,
+)
+AMAZON_HOST = re.compile(r"^(?:[a-z0-9-]+\.)*amazon\.((?:com?\.)?[a-z]{2,3})$")
+
+def parse_asin(link):
+    # Returns (tld, ASIN) for an Amazon product page, else None
+    if not link:
+        return None
+    parts = urlsplit(link.strip())
+    host = AMAZON_HOST.match((parts.hostname or "").lower())
+    match = ASIN_PATTERN.search(parts.path)
+    if not host or not match:
+        return None
+    return host.group(1), match.group(1).upper()
+
+def canonical_link(link):
+    if not link:
+        return link
+    parsed = parse_asin(link)
+    if parsed is None:
+        return link.strip()
+    tld, asin = parsed
+    return f"https://www.amazon.{tld}/dp/{asin}"
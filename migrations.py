@@ -0,0 +1,299 @@
+from links import canonical_link
+
+# ================= SCHEMA MIGRATIONS =================
+# Each migration runs once, in order, inside its own transaction.
+# The applied version is kept in PRAGMA user_version, so never edit or
+# reorder a migration that has shipped - append a new one instead.
+
+def _create_orders(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            product_name TEXT,
+            product_link TEXT,
+            quantity INTEGER,
+            customer_name TEXT,
+            order_number TEXT,
+            payment_method TEXT,
+            payment_info TEXT,
+            review_sent INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _add_order_indexes(conn):
+    # /myorders and handle_photo: one user's orders, newest first
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_user_review_created
+        ON orders (user_id, review_sent, created_at)
+    """)
+    # Review reminders only ever look at orders without a screenshot
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_orders_pending_review
+        ON orders (user_id, product_name)
+        WHERE review_sent = 0
+    """)
+    # /allorders export
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders (created_at)")
+
+def _create_products(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,
+            link TEXT,
+            stock INTEGER NOT NULL DEFAULT 0 CHECK (stock >= 0)
+        )
+    """)
+    # /start lists only products that are in stock
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_products_in_stock ON products (id) WHERE stock > 0")
+
+def _create_sessions(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+
+def _create_export_state(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS export_state (
+            name TEXT PRIMARY KEY,
+            last_order_id INTEGER NOT NULL DEFAULT 0,
+            exported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+# ================= ORDER STATS =================
+# order_stats holds running counters per (kind, key):
+#   total/''  payment/<method>  product/<name>  day/<YYYY-MM-DD>
+# kept up to date by triggers on orders, so /stats never scans orders.
+STATS_KINDS = {
+    "total": "''",
+    "product": "{row}.product_name",
+    "day": "date({row}.created_at)",
+    "payment": "{row}.payment_method",
+}
+
+def _stats_upsert(row, sign, kinds=tuple(STATS_KINDS)):
+    statements = []
+    for kind in kinds:
+        key = STATS_KINDS[kind].format(row=row)
+        statements.append(f"""
+            INSERT INTO order_stats (kind, key, orders, units)
+            SELECT '{kind}', {key}, {sign}1, {sign}COALESCE({row}.quantity, 0)
+            WHERE {key} IS NOT NULL
+            ON CONFLICT(kind, key) DO UPDATE SET
+                orders = orders + excluded.orders,
+                units = units + excluded.units;
+        """)
+    return "".join(statements)
+
+def rebuild_stats(conn):
+    conn.execute("DELETE FROM order_stats")
+    for kind, key in STATS_KINDS.items():
+        key = key.format(row="orders")
+        conn.execute(f"""
+            INSERT INTO order_stats (kind, key, orders, units)
+            SELECT '{kind}', {key}, COUNT(*), COALESCE(SUM(quantity), 0)
+            FROM orders
+            WHERE {key} IS NOT NULL
+            GROUP BY {key}
+        """)
+
+def _create_order_stats(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS order_stats (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            orders INTEGER NOT NULL DEFAULT 0,
+            units INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_order_stats_insert AFTER INSERT ON orders
+        BEGIN {_stats_upsert("NEW", "+")} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_order_stats_delete AFTER DELETE ON orders
+        BEGIN {_stats_upsert("OLD", "-")} END
+    """)
+    # Paying for an order only moves it between payment methods
+    payment = ("payment",)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_order_stats_update_payment
+        AFTER UPDATE OF payment_method, quantity ON orders
+        WHEN OLD.payment_method IS NOT NEW.payment_method OR OLD.quantity IS NOT NEW.quantity
+        BEGIN {_stats_upsert("OLD", "-", payment)} {_stats_upsert("NEW", "+", payment)} END
+    """)
+    other = ("total", "product", "day")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_order_stats_update
+        AFTER UPDATE OF product_name, quantity, created_at ON orders
+        BEGIN {_stats_upsert("OLD", "-", other)} {_stats_upsert("NEW", "+", other)} END
+    """)
+    rebuild_stats(conn)
+
+# ================= REVIEW STORE =================
+# Screenshots are stored once per content hash (see reviews.py); these
+# tables map Telegram files and orders to the stored blobs.
+def _create_review_store(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS review_blobs (
+            sha256 TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS review_files (
+            file_unique_id TEXT PRIMARY KEY,
+            sha256 TEXT NOT NULL REFERENCES review_blobs (sha256)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS order_reviews (
+            order_id INTEGER PRIMARY KEY REFERENCES orders (id),
+            sha256 TEXT NOT NULL REFERENCES review_blobs (sha256),
+            file_unique_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_reviews_sha256 ON order_reviews (sha256)")
+
+def _create_review_variants(conn):
+    # Thumbnails and recompressed copies of each blob; the original may be
+    # deleted after a retention window (evicted_at)
+    conn.execute("ALTER TABLE review_blobs ADD COLUMN evicted_at TIMESTAMP")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS review_variants (
+            sha256 TEXT NOT NULL REFERENCES review_blobs (sha256),
+            kind TEXT NOT NULL,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            width INTEGER,
+            height INTEGER,
+            PRIMARY KEY (sha256, kind)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_review_blobs_created_at
+        ON review_blobs (created_at)
+        WHERE evicted_at IS NULL
+    """)
+
+def _add_review_gallery(conn):
+    # telegram_file_id: the photo as Telegram already has it, so the admin
+    # gallery re-sends it without uploading; viewed_at: shown to the admin
+    conn.execute("ALTER TABLE review_blobs ADD COLUMN telegram_file_id TEXT")
+    conn.execute("ALTER TABLE order_reviews ADD COLUMN viewed_at TIMESTAMP")
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_order_reviews_unviewed
+        ON order_reviews (order_id)
+        WHERE viewed_at IS NULL
+    """)
+
+def _create_outbox(conn):
+    # Bot API calls that failed and are retried later, see outbound.py.
+    # payload is the JSON of the call's parameters.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            method TEXT NOT NULL,
+            chat_id INTEGER,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at)")
+
+def _create_reservations(conn):
+    # Stock held for a buyer between the quantity and order number steps.
+    # One hold per buyer; the reaper walks idx_reservations_expires_at.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS reservations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL UNIQUE,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reservations_expires_at ON reservations (expires_at)")
+
+def _add_product_source_stock(conn):
+    # Stock as last read from products.json. A reload adds the difference
+    # to the live stock instead of overwriting it, see db.apply_products_file.
+    conn.execute("ALTER TABLE products ADD COLUMN source_stock INTEGER")
+
+def _normalize_product_links(conn):
+    # Links are stored once, in canonical form (see links.py), on products;
+    # orders reference the product by id. orders.product_link is only kept
+    # (shortened) where it differs from the product's link, e.g. for
+    # products no longer in the table.
+    conn.create_function("canonical_link", 1, canonical_link, deterministic=True)
+    conn.execute("UPDATE products SET link = canonical_link(link) WHERE link IS NOT NULL")
+    conn.execute("ALTER TABLE orders ADD COLUMN product_id INTEGER REFERENCES products (id)")
+    conn.execute("""
+        UPDATE orders SET product_id = (SELECT id FROM products WHERE products.name = orders.product_name)
+    """)
+    conn.execute("""
+        UPDATE orders SET product_link = NULLIF(
+            canonical_link(product_link),
+            (SELECT link FROM products WHERE products.id = orders.product_id)
+        )
+        WHERE product_link IS NOT NULL
+    """)
+
+MIGRATIONS = [
+    (1, "create orders table", _create_orders),
+    (2, "add order indexes", _add_order_indexes),
+    (3, "create products table", _create_products),
+    (4, "create sessions table", _create_sessions),
+    (5, "create export state table", _create_export_state),
+    (6, "create order stats", _create_order_stats),
+    (7, "create review store", _create_review_store),
+    (8, "create review variants", _create_review_variants),
+    (9, "add review gallery columns", _add_review_gallery),
+    (10, "create outbox", _create_outbox),
+    (11, "create reservations", _create_reservations),
+    (12, "add products source stock", _add_product_source_stock),
+    (13, "normalize product links", _normalize_product_links),
+]
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    applied = []
+    for version, name, apply in MIGRATIONS:
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes
+        # starting at once cannot both apply the same migration.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if get_version(conn) >= version:
+                conn.rollback()
+                continue
+            apply(conn)
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(name)
+        print(f"✅ Миграция {version} применена: {name}")
+
+    if applied:
+        conn.execute("PRAGMA optimize")
+    return applied
@@ -0,0 +1,151 @@
+import os
+import asyncio
+from datetime import datetime
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from outbound import outbound_args, PRIORITY_ADMIN
+
+# ================= SETTINGS =================
+# A digest goes out every NOTIFY_INTERVAL seconds or after NOTIFY_MAX_EVENTS
+# events, whichever comes first
+NOTIFY_INTERVAL = float(os.getenv("NOTIFY_INTERVAL", "5"))
+NOTIFY_MAX_EVENTS = int(os.getenv("NOTIFY_MAX_EVENTS", "20"))
+# One live message is edited for this long, then a new one is started so
+# the admin gets a fresh notification
+NOTIFY_LIVE_WINDOW = int(os.getenv("NOTIFY_LIVE_WINDOW", "600"))
+MESSAGE_LIMIT = 4096
+
+# ================= DIGEST =================
+class Digest:
+    # Everything reported in one live message
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.message_id = None
+        self.lines = []
+        self.counts = {}
+
+    def add(self, kind, line):
+        self.lines.append(line)
+        self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    def render(self):
+        header = f"📋 Сводка с {self.started_at:%H:%M} (обновлено {datetime.now():%H:%M:%S})\n"
+        header += " · ".join(f"{kind}: {count}" for kind, count in self.counts.items()) + "\n\n"
+        # Newest events win when the message gets too long
+        body, skipped = [], 0
+        budget = MESSAGE_LIMIT - len(header) - 40
+        for line in reversed(self.lines):
+            if budget - len(line) - 1 < 0:
+                skipped = len(self.lines) - len(body)
+                break
+            body.append(line)
+            budget -= len(line) + 1
+        text = header
+        if skipped:
+            text += f"… и ещё {skipped} ранее\n"
+        return text + "\n".join(reversed(body))
+
+# ================= NOTIFIER =================
+class AdminNotifier:
+    # Handlers call notify() and move on; a background task coalesces the
+    # events into one live digest message per window and keeps it edited.
+    def __init__(self, chat_id, interval=NOTIFY_INTERVAL, max_events=NOTIFY_MAX_EVENTS, live_window=NOTIFY_LIVE_WINDOW):
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_events = max_events
+        self.live_window = live_window
+        self.bot = None
+        self._pending = []
+        self._wakeup = None
+        self._task = None
+        self._digest = None
+        # The current digest has events Telegram has not seen yet
+        self._dirty = False
+        self.events = 0
+        self.sent = 0
+        self.edited = 0
+        self.rate_limited = 0
+
+    def notify(self, bot, kind, line):
+        # Never blocks and never raises, so handlers can call it inline
+        if self._task is None:
+            self.bot = bot
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._pending.append((kind, line))
+        self.events += 1
+        if len(self._pending) >= self.max_events:
+            self._wakeup.set()
+
+    async def close(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        # Last digest before shutdown
+        try:
+            await asyncio.wait_for(self.flush(), 10)
+        except (asyncio.TimeoutError, TelegramError) as e:
+            print(f"Не удалось отправить сводку администратору: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except TelegramError as e:
+                # Events stay pending and go out with the next digest
+                print(f"Не удалось отправить сводку администратору: {e}")
+
+    async def flush(self):
+        if not self._pending and not self._dirty:
+            return
+        digest = self._digest
+        expired = digest is not None and (datetime.now() - digest.started_at).total_seconds() > self.live_window
+        # A digest that failed to publish is finished first, never dropped
+        if digest is None or (expired and not self._dirty):
+            digest = self._digest = Digest()
+        for kind, line in self._pending:
+            digest.add(kind, line)
+        self._pending = []
+        self._dirty = True
+        if await self._publish(digest):
+            self._dirty = False
+
+    async def _publish(self, digest):
+        # Pacing and RetryAfter are handled by the bot's rate limiter, which
+        # sends these after replies and reminders (see outbound.py)
+        text = digest.render()
+        rate_limit_args = outbound_args(PRIORITY_ADMIN, spool=False)
+        for _ in range(2):
+            try:
+                if digest.message_id is None:
+                    message = await self.bot.send_message(self.chat_id, text, rate_limit_args=rate_limit_args)
+                    digest.message_id = message.message_id
+                    self.sent += 1
+                else:
+                    await self.bot.edit_message_text(
+                        text, chat_id=self.chat_id, message_id=digest.message_id, rate_limit_args=rate_limit_args
+                    )
+                    self.edited += 1
+                return True
+            except RetryAfter:
+                self.rate_limited += 1
+                return False
+            except BadRequest as e:
+                if "not modified" in str(e):
+                    return True
+                if digest.message_id is None:
+                    raise
+                # The live message was deleted or is too old to edit
+                digest.message_id = None
+        return False
+
+    def summary(self):
+        return f"Уведомления: событий {self.events}, сообщений {self.sent}, правок {self.edited}, 429: {self.rate_limited}"
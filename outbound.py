@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import heapq
+import asyncio
+import itertools
+
+import httpx
+from telegram.error import Forbidden, BadRequest, RetryAfter, NetworkError, TelegramError
+from telegram.ext import BaseRateLimiter
+
+from db import spool_outbox, get_due_outbox, reschedule_outbox, delete_outbox
+from ratelimit import TokenBucket
+from repository import run_db
+
+# ================= SETTINGS =================
+# Telegram allows about 30 messages per second across all chats, about one
+# per second in a private chat and 20 per minute in a group
+OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "25"))
+# Any one second may see OUTBOUND_RATE + OUTBOUND_BURST sends, keep it under 30
+OUTBOUND_BURST = 5
+OUTBOUND_CHAT_RATE = 1.0
+OUTBOUND_GROUP_RATE = 20 / 60
+# Telegram tolerates short bursts in a private chat, e.g. a buyer clicking
+# quickly through the order flow; groups get less slack
+OUTBOUND_CHAT_BURST = 10
+OUTBOUND_GROUP_BURST = 3
+# A call that gets RetryAfter is repeated after the wait this many times
+OUTBOUND_MAX_RETRIES = 3
+# Idle per-chat buckets are dropped once there are this many
+OUTBOUND_MAX_CHATS = 10000
+# Failed messages are retried from the outbox table with exponential
+# backoff starting at OUTBOX_INTERVAL seconds
+OUTBOX_INTERVAL = int(os.getenv("OUTBOX_INTERVAL", "30"))
+OUTBOX_BATCH = 100
+OUTBOX_MAX_ATTEMPTS = 8
+# Only calls without uploads can be replayed from JSON
+SPOOL_METHODS = {"sendMessage"}
+
+# Lower goes first when the global limit is the bottleneck
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REMINDER = 1
+PRIORITY_ADMIN = 2
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "ответы",
+    PRIORITY_REMINDER: "напоминания",
+    PRIORITY_ADMIN: "администратор",
+}
+
+def outbound_args(priority, spool=True):
+    # rate_limit_args for bot calls, e.g.
+    #   bot.send_message(..., rate_limit_args=outbound_args(PRIORITY_REMINDER))
+    # Calls without it are interactive and spooled on failure.
+    return {"priority": priority, "spool": spool}
+
+def is_limited(endpoint):
+    # Calls that count against Telegram's message limits
+    return endpoint.startswith(("send", "edit", "copyMessage", "forwardMessage"))
+
+def _retry_seconds(error):
+    retry_after = error.retry_after
+    if not isinstance(retry_after, (int, float)):
+        retry_after = retry_after.total_seconds()
+    return retry_after
+
+def _never_sent(error):
+    # Connection and pool failures happen before the request leaves the
+    # bot. After a read timeout or a dropped connection Telegram may have
+    # delivered the message already, and a replay would send it twice.
+    return isinstance(error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout))
+
+def _to_json(value):
+    return value.to_dict() if hasattr(value, "to_dict") else str(value)
+
+# ================= LIMITER =================
+class OutboundLimiter(BaseRateLimiter):
+    # Every Bot API call of the application goes through process_request.
+    # A send first waits for its chat's bucket, then for a token of the
+    # global bucket; while the global bucket is the bottleneck tokens go to
+    # the highest priority waiter, so replies overtake a running broadcast.
+    def __init__(self, rate=OUTBOUND_RATE, max_retries=OUTBOUND_MAX_RETRIES):
+        self.bucket = TokenBucket(rate, min(rate, OUTBOUND_BURST))
+        self.max_retries = max_retries
+        self._chats = {}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._dispatcher = None
+        # priority -> [calls, total wait, max wait]
+        self.waits = {priority: [0, 0.0, 0.0] for priority in PRIORITY_NAMES}
+        self.rate_limited = 0
+        self.spooled = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for _, _, future in self._waiters:
+            future.cancel()
+        self._waiters = []
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if not is_limited(endpoint):
+            return await callback(*args, **kwargs)
+
+        options = rate_limit_args if isinstance(rate_limit_args, dict) else {}
+        priority = options.get("priority", PRIORITY_INTERACTIVE)
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            await self._acquire(priority)
+            self._record_wait(priority, time.monotonic() - started)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                # The flood limit applies to the whole bot, so every sender waits
+                self.rate_limited += 1
+                self.bucket.pause(_retry_seconds(e))
+                if attempt == self.max_retries:
+                    await self._spool(endpoint, data, priority, options, e)
+                    raise
+            except BadRequest:
+                # A subclass of NetworkError, but replaying it would fail again
+                raise
+            except NetworkError as e:
+                # Includes TimedOut. Only spooled when it provably did not reach Telegram.
+                if _never_sent(e):
+                    await self._spool(endpoint, data, priority, options, e)
+                raise
+
+    # ---------------- buckets ----------------
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= OUTBOUND_MAX_CHATS:
+                # A full bucket behaves exactly like a new one
+                self._chats = {key: b for key, b in self._chats.items() if b.delay(b.capacity) > 0}
+            group = str(chat_id).startswith(("-", "@"))
+            if group:
+                bucket = TokenBucket(OUTBOUND_GROUP_RATE, OUTBOUND_GROUP_BURST)
+            else:
+                bucket = TokenBucket(OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _acquire(self, priority):
+        if not self._waiters and self.bucket.try_acquire():
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await future
+
+    async def _dispatch(self):
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # The caller was cancelled while waiting
+                heapq.heappop(self._waiters)
+                continue
+            if not self.bucket.try_acquire():
+                await asyncio.sleep(self.bucket.delay())
+                continue
+            heapq.heappop(self._waiters)[2].set_result(None)
+
+    # ---------------- spool ----------------
+    async def _spool(self, endpoint, data, priority, options, error):
+        if endpoint not in SPOOL_METHODS or not options.get("spool", True):
+            return
+        try:
+            payload = json.dumps(data, default=_to_json, ensure_ascii=False)
+            await run_db(spool_outbox, endpoint, data.get("chat_id"), payload, priority, time.time() + OUTBOX_INTERVAL, str(error))
+            self.spooled += 1
+        except Exception as e:
+            print(f"❌ Не удалось сохранить сообщение для повторной отправки: {e}")
+
+    # ---------------- stats ----------------
+    def _record_wait(self, priority, waited):
+        stats = self.waits.setdefault(priority, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    def summary(self):
+        parts = [
+            f"{PRIORITY_NAMES.get(priority, priority)} {calls} (ожидание ср. {total / calls * 1000:.0f} мс, макс. {longest * 1000:.0f} мс)"
+            for priority, (calls, total, longest) in sorted(self.waits.items())
+            if calls
+        ]
+        return (
+            f"Исходящие: {', '.join(parts) or 'нет'}\n"
+            f"429: {self.rate_limited}, отложено в outbox: {self.spooled}"
+        )
+
+# ================= OUTBOX =================
+class Outbox:
+    # Sends messages the limiter spooled to the outbox table, due ones of
+    # the highest priority first. They survive restarts; each failure
+    # doubles the delay until OUTBOX_MAX_ATTEMPTS, then the message is dropped.
+    def __init__(self, batch=OUTBOX_BATCH, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.batch = batch
+        self.max_attempts = max_attempts
+        # Created in deliver(), inside the running loop (see CatalogReloader)
+        self._lock = None
+        self.sent = 0
+        self.dropped = 0
+
+    async def deliver(self, bot):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        if self._lock.locked():
+            return 0
+        async with self._lock:
+            rows = await run_db(get_due_outbox, time.time(), self.batch)
+            if not rows:
+                return 0
+            results = await asyncio.gather(*(self._send(bot, row) for row in rows))
+            done = [row[0] for row, retry in zip(rows, results) if retry is None]
+            retries = [retry for retry in results if retry is not None]
+            if done:
+                await run_db(delete_outbox, done)
+            if retries:
+                await run_db(reschedule_outbox, retries)
+            return len(done)
+
+    async def _send(self, bot, row):
+        # None when the row is finished, else (next_attempt_at, error, id)
+        row_id, method, chat_id, payload, priority, attempts = row
+        params = json.loads(payload)
+        try:
+            if method != "sendMessage":
+                raise BadRequest(f"Unsupported method {method}")
+            await bot.send_message(
+                params.pop("chat_id"), params.pop("text"), api_kwargs=params,
+                rate_limit_args=outbound_args(priority, spool=False),
+            )
+            self.sent += 1
+            return None
+        except (Forbidden, BadRequest) as e:
+            self.dropped += 1
+            print(f"Не удалось отправить отложенное сообщение пользователю {chat_id}: {e}")
+            return None
+        except TelegramError as e:
+            if isinstance(e, NetworkError) and not _never_sent(e):
+                # Telegram may have delivered it; another attempt could send it twice
+                print(f"Отложенное сообщение пользователю {chat_id} могло не дойти: {e}")
+                return None
+            if attempts + 1 >= self.max_attempts:
+                self.dropped += 1
+                print(f"Отложенное сообщение пользователю {chat_id} не отправлено после {self.max_attempts} попыток: {e}")
+                return None
+            return (time.time() + OUTBOX_INTERVAL * 2 ** (attempts + 1), str(e), row_id)
+
+    def summary(self, pending):
+        return f"Outbox: ждут {pending}, отправлено {self.sent}, отброшено {self.dropped}"
@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+from telegram.ext import BaseUpdateProcessor
+
+# ================= SETTINGS =================
+# Updates handled at the same time across all users
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# Upper bound on updates accepted but not finished yet (running + waiting)
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1000"))
+WAIT_SAMPLES = 1000
+
+def update_key(update):
+    # Updates with the same key are handled strictly one after another
+    user = getattr(update, "effective_user", None)
+    if user:
+        return user.id
+    chat = getattr(update, "effective_chat", None)
+    if chat:
+        return chat.id
+    return None
+
+# ================= USER QUEUE =================
+class _UserQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        # asyncio.Lock wakes waiters in FIFO order, so it doubles as the queue
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+# ================= PROCESSOR =================
+class UserOrderedProcessor(BaseUpdateProcessor):
+    # Runs different users' updates in parallel, but each user's updates in
+    # the order they arrived, so the step-by-step order dialog in
+    # handle_message never sees two messages of one user at once.
+    #
+    # PTB's own semaphore is only a backstop (UPDATE_MAX_PENDING). The real
+    # cap is self._slots, taken after the user's turn comes, so a user with
+    # a backlog holds at most one slot and cannot starve the others.
+    def __init__(self, concurrency=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING):
+        super().__init__(max(max_pending, concurrency))
+        self.concurrency = concurrency
+        self._slots = None
+        self._queues = {}
+        self.processed = 0
+        self.waiting = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def pending(self):
+        return self.current_concurrent_updates
+
+    async def do_process_update(self, update, coroutine):
+        queued_at = time.monotonic()
+        key = update_key(update)
+        queue = None
+        if key is not None:
+            # No await before this point, so updates join the user's queue in
+            # the order PTB created their tasks, i.e. the order they arrived
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = _UserQueue()
+            queue.depth += 1
+            self.max_depth = max(self.max_depth, queue.depth)
+
+        self.waiting += 1
+        started = False
+        try:
+            if queue:
+                await queue.lock.acquire()
+            try:
+                async with self._slots:
+                    self.waiting -= 1
+                    started = True
+                    self._record_wait(time.monotonic() - queued_at)
+                    try:
+                        await coroutine
+                    finally:
+                        self.processed += 1
+            finally:
+                if queue:
+                    queue.lock.release()
+        finally:
+            if not started:
+                # Cancelled while waiting (shutdown)
+                self.waiting -= 1
+                if hasattr(coroutine, "close"):
+                    coroutine.close()
+            if queue:
+                queue.depth -= 1
+                if queue.depth == 0:
+                    self._queues.pop(key, None)
+
+    # ================= METRICS =================
+    def _record_wait(self, seconds):
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+        self._waits.append(seconds)
+
+    def metrics(self):
+        waits = sorted(self._waits)
+        return {
+            "processed": self.processed,
+            "running": self.pending - self.waiting,
+            "waiting": self.waiting,
+            "users_queued": len(self._queues),
+            "max_user_depth": self.max_depth,
+            "wait_mean": self.wait_total / self.processed if self.processed else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+    def summary(self):
+        m = self.metrics()
+        return (
+            f"Обработано: {m['processed']}, сейчас {m['running']}/{self.concurrency}, в очереди {m['waiting']} "
+            f"({m['users_queued']} польз., макс. глубина {m['max_user_depth']})\n"
+            f"Ожидание: среднее {m['wait_mean'] * 1000:.1f} мс, p95 {m['wait_p95'] * 1000:.1f} мс, "
+            f"макс. {m['wait_max'] * 1000:.1f} мс"
+        )
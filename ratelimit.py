@@ -0,0 +1,45 @@
+import time
+import asyncio
+
+# ================= TOKEN BUCKET =================
+class TokenBucket:
+    # Allows `rate` operations per second on average with bursts of up to
+    # `capacity`. pause() blocks every caller, e.g. after a 429 from Telegram.
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens=1):
+        # Seconds until `tokens` would be available
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, (tokens - self._tokens) / self.rate)
+        return max(wait, self._paused_until - now)
+
+    async def acquire(self, tokens=1):
+        # The lock keeps waiters in FIFO order
+        async with self._lock:
+            while not self.try_acquire(tokens):
+                await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
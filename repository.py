@@ -0,0 +1,29 @@
+import os
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+# ================= SETTINGS =================
+# Blocking sqlite3 calls run here instead of on the bot's event loop.
+DB_THREADS = int(os.getenv("DB_THREADS", "1"))
+# Calls beyond this limit wait on the event loop instead of piling up
+# in the executor's unbounded work queue.
+DB_MAX_PENDING = int(os.getenv("DB_MAX_PENDING", "256"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+_pending = None
+
+def _get_pending():
+    global _pending
+    if _pending is None:
+        _pending = asyncio.Semaphore(DB_MAX_PENDING)
+    return _pending
+
+# ================= ASYNC ACCESS =================
+async def run_db(func, *args, **kwargs):
+    async with _get_pending():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+def shutdown_repository():
+    _executor.shutdown(wait=True)
@@ -0,0 +1,409 @@
+import os
+import sys
+import time
+import uuid
+import asyncio
+import hashlib
+import multiprocessing
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+import httpx
+from telegram.error import TelegramError
+
+from db import (
+    get_review_blob_by_file,
+    save_review,
+    save_review_variants,
+    get_review_blobs_without_variants,
+    get_review_blobs_to_evict,
+    mark_review_blobs_evicted,
+)
+from repository import run_db
+
+# ================= SETTINGS =================
+REVIEWS_DIR = "reviews"
+# Downloads in progress; on the same filesystem so finished files are renamed
+REVIEWS_TMP_DIR = os.path.join(REVIEWS_DIR, "tmp")
+REVIEW_WORKERS = int(os.getenv("REVIEW_WORKERS", "4"))
+# Screenshots waiting for a worker; beyond this buyers are asked to retry
+REVIEW_QUEUE_SIZE = int(os.getenv("REVIEW_QUEUE_SIZE", "200"))
+REVIEW_MAX_ATTEMPTS = 3
+REVIEW_CHUNK_SIZE = 64 * 1024
+REVIEW_DOWNLOAD_TIMEOUT = 30
+
+# Thumbnails and archival copies need Pillow; without it only originals are kept
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# kind -> (max side in px, JPEG quality)
+REVIEW_VARIANTS = {
+    "thumb": (320, 70),
+    "archive": (1600, 80),
+}
+REVIEW_IMAGE_PROCESSES = int(os.getenv("REVIEW_IMAGE_PROCESSES", "1"))
+# Originals older than this are deleted once an archive copy exists; 0 keeps them
+REVIEW_ORIGINAL_RETENTION_DAYS = int(os.getenv("REVIEW_ORIGINAL_RETENTION_DAYS", "30"))
+
+STAGES = ("queue", "dedup", "get_file", "download", "save", "variants")
+
+# ================= METRICS =================
+class StageStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+# ================= STORE =================
+# Screenshots are stored once per content, as reviews/ab/cd/<sha256>.jpg.
+# Two levels of 256 directories keep every directory small even with
+# millions of files. Which order uses which blob lives in the database.
+def blob_path(sha256):
+    return os.path.join(sha256[:2], sha256[2:4], f"{sha256}.jpg")
+
+def store_blob(part, sha256):
+    # Moves a finished download into the store, or drops it if the same
+    # content is already there. Returns the path relative to REVIEWS_DIR.
+    relative = blob_path(sha256)
+    path = os.path.join(REVIEWS_DIR, relative)
+    if os.path.exists(path):
+        os.remove(part)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(part, path)
+    return relative
+
+# ================= VARIANTS =================
+def variant_path(relative, kind):
+    # Stored next to the original: ab/cd/<sha256>.<kind>.jpg
+    return relative[:-len(".jpg")] + f".{kind}.jpg"
+
+def make_variants(relative, reviews_dir=REVIEWS_DIR):
+    # Runs in a worker process. Returns [(kind, path, size, width, height)].
+    source = os.path.join(reviews_dir, relative)
+    variants = []
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for kind, (max_side, quality) in REVIEW_VARIANTS.items():
+            copy = image.copy()
+            copy.thumbnail((max_side, max_side), Image.LANCZOS)
+            path = variant_path(relative, kind)
+            target = os.path.join(reviews_dir, path)
+            part = target + ".part"
+            copy.save(part, "JPEG", quality=quality, optimize=True, progressive=True)
+            os.replace(part, target)
+            variants.append((kind, path, os.path.getsize(target), copy.width, copy.height))
+    return variants
+
+_image_pool = None
+
+def get_image_pool():
+    # Image work is CPU bound, so it runs in separate processes. spawn keeps
+    # the children free of the bot's threads and open database connections;
+    # they re-import bot.py, whose startup() only runs in build_app.
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(REVIEW_IMAGE_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+    return _image_pool
+
+def shutdown_image_pool():
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=True)
+        _image_pool = None
+
+async def build_variants(sha256, relative):
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(get_image_pool(), make_variants, relative)
+    await run_db(save_review_variants, sha256, variants)
+    return variants
+
+async def build_missing_variants(limit=100):
+    # Backfill for blobs stored before variants existed (or while Pillow was missing)
+    if Image is None:
+        return 0
+    built = 0
+    for sha256, relative in await run_db(get_review_blobs_without_variants, "archive", limit):
+        try:
+            await build_variants(sha256, relative)
+            built += 1
+        except Exception as e:
+            print(f"Ошибка создания превью {relative}: {e}")
+    return built
+
+def evict_originals(retention_days=REVIEW_ORIGINAL_RETENTION_DAYS):
+    # Deletes originals past the retention window that have an archive copy.
+    # Blocking and possibly long; run it with asyncio.to_thread, not run_db.
+    if retention_days <= 0:
+        return 0
+    before = (datetime.utcnow() - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    evicted = 0
+    while True:
+        rows = get_review_blobs_to_evict("archive", before)
+        if not rows:
+            return evicted
+        for sha256, relative in rows:
+            try:
+                os.remove(os.path.join(REVIEWS_DIR, relative))
+            except FileNotFoundError:
+                pass
+        mark_review_blobs_evicted([sha256 for sha256, _ in rows])
+        evicted += len(rows)
+
+# ================= JOB =================
+class ReviewJob:
+    __slots__ = ("user_id", "chat_id", "order_id", "file_id", "file_unique_id", "queued_at", "attempts")
+
+    def __init__(self, user_id, chat_id, order_id, file_id, file_unique_id=None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.order_id = order_id
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+# ================= INGESTOR =================
+class ReviewIngestor:
+    # The photo handler only queues a job and answers the buyer; workers
+    # fetch the file, stream it to disk and then mark the review as sent.
+    def __init__(self, workers=REVIEW_WORKERS, queue_size=REVIEW_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.bot = None
+        self._queue = None
+        self._tasks = []
+        self._client = None
+        # Orders with a screenshot on its way, so a second screenshot from
+        # the same buyer goes to their next pending order
+        self.in_flight = set()
+        # file_unique_id -> Event set when its download has finished
+        self._fetching = {}
+        self.stages = {name: StageStats() for name in STAGES}
+        self.done = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+
+    def _start(self, bot):
+        self.bot = bot
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._client = httpx.AsyncClient(timeout=REVIEW_DOWNLOAD_TIMEOUT)
+        os.makedirs(REVIEWS_TMP_DIR, exist_ok=True)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, bot, job):
+        # Returns False when the queue is full
+        if self._queue is None:
+            self._start(bot)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.in_flight.add(job.order_id)
+        return True
+
+    async def close(self, timeout=30):
+        # Let queued screenshots finish, then stop the workers
+        if self._queue is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Не сохранено скриншотов при остановке: {self._queue.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+        self._queue = None
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                self.stages["queue"].add(time.monotonic() - job.queued_at)
+                await self._process(job)
+            except Exception as e:
+                # e.g. the order was cancelled meanwhile; keep the worker alive
+                self.failed += 1
+                print(f"❌ Ошибка обработки скриншота для заказа {job.order_id}: {e!r}")
+            finally:
+                self.in_flight.discard(job.order_id)
+                self._queue.task_done()
+
+    async def _process(self, job):
+        while True:
+            job.attempts += 1
+            try:
+                await self._ingest(job)
+                self.done += 1
+                return
+            except (TelegramError, httpx.HTTPError, OSError) as e:
+                if job.attempts >= REVIEW_MAX_ATTEMPTS:
+                    break
+                self.retried += 1
+                print(f"Повтор загрузки скриншота для заказа {job.order_id}: {e}")
+                await asyncio.sleep(2 ** job.attempts)
+
+        self.failed += 1
+        print(f"Ошибка при сохранении скриншота для заказа {job.order_id} после {job.attempts} попыток")
+        try:
+            await self.bot.send_message(job.chat_id, "Ошибка при сохранении скриншота. Пожалуйста, отправьте его ещё раз.")
+        except TelegramError as e:
+            print(f"Не удалось уведомить пользователя {job.user_id}: {e}")
+
+    async def _ingest(self, job):
+        if job.file_unique_id:
+            started = time.monotonic()
+            while True:
+                fetching = self._fetching.get(job.file_unique_id)
+                if fetching is None:
+                    break
+                # Another worker is downloading it right now
+                await fetching.wait()
+            # Claimed before the first await, so no other worker fetches it too
+            fetching = self._fetching[job.file_unique_id] = asyncio.Event()
+            try:
+                # The same Telegram file was stored before: only link the order
+                sha256 = await run_db(get_review_blob_by_file, job.file_unique_id)
+                self.stages["dedup"].add(time.monotonic() - started)
+                if sha256:
+                    await run_db(save_review, job.order_id, sha256, job.file_unique_id)
+                    self.duplicates += 1
+                    print(f"Скриншот для заказа {job.order_id} уже сохранён: {sha256[:12]}")
+                    return
+                await self._fetch(job)
+            finally:
+                self._fetching.pop(job.file_unique_id, None)
+                fetching.set()
+        else:
+            await self._fetch(job)
+
+    async def _fetch(self, job):
+        started = time.monotonic()
+        file = await self.bot.get_file(job.file_id)
+        self.stages["get_file"].add(time.monotonic() - started)
+
+        started = time.monotonic()
+        part = os.path.join(REVIEWS_TMP_DIR, f"{uuid.uuid4().hex}.part")
+        try:
+            sha256, size = await self._download(file.file_path, part)
+            relative = store_blob(part, sha256)
+        finally:
+            if os.path.exists(part):
+                os.remove(part)
+        self.stages["download"].add(time.monotonic() - started)
+
+        started = time.monotonic()
+        await run_db(save_review, job.order_id, sha256, job.file_unique_id, relative, size, job.file_id)
+        self.stages["save"].add(time.monotonic() - started)
+        print(f"Сохранён скриншот для заказа {job.order_id}: {relative}")
+
+        if Image is not None:
+            # The review is saved already; a broken image only costs the previews
+            started = time.monotonic()
+            try:
+                await build_variants(sha256, relative)
+                self.stages["variants"].add(time.monotonic() - started)
+            except Exception as e:
+                print(f"Ошибка создания превью {relative}: {e}")
+
+    async def _download(self, url, part):
+        # Streams to a temp file and hashes on the fly, so the content is
+        # read only once. Returns (sha256, size).
+        digest = hashlib.sha256()
+        size = 0
+        async with self._client.stream("GET", url) as response:
+            response.raise_for_status()
+            with open(part, "wb") as f:
+                async for chunk in response.aiter_bytes(REVIEW_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+        return digest.hexdigest(), size
+
+    def summary(self):
+        stages = ", ".join(
+            f"{name} {stats.mean * 1000:.0f}/{stats.max * 1000:.0f} мс" for name, stats in self.stages.items()
+        )
+        return (
+            f"Скриншоты: сохранено {self.done} (дублей {self.duplicates}), ошибок {self.failed}, повторов {self.retried}, "
+            f"отклонено {self.rejected}, в очереди {self.pending}\n"
+            f"Этапы (среднее/макс.): {stages}"
+        )
+
+# ================= LEGACY FILES =================
+def import_legacy_reviews():
+    # Moves reviews/review_{user_id}_{order_id}.jpg files saved by older
+    # versions into the store
+    imported = 0
+    for name in sorted(os.listdir(REVIEWS_DIR)):
+        if not (name.startswith("review_") and name.endswith(".jpg")):
+            continue
+        try:
+            order_id = int(name[:-4].rsplit("_", 1)[1])
+        except (IndexError, ValueError):
+            continue
+        path = os.path.join(REVIEWS_DIR, name)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(REVIEW_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        sha256 = digest.hexdigest()
+        size = os.path.getsize(path)
+        try:
+            save_review(order_id, sha256, None, blob_path(sha256), size)
+        except Exception as e:
+            print(f"❌ {name}: {e}")
+            continue
+        store_blob(path, sha256)
+        imported += 1
+    return imported
+
+async def _build_all_variants():
+    total = 0
+    while True:
+        built = await build_missing_variants()
+        total += built
+        if not built:
+            return total
+
+if __name__ == "__main__":
+    # python reviews.py import-legacy|variants|evict
+    command = sys.argv[1] if len(sys.argv) == 2 else None
+    if command not in ("import-legacy", "variants", "evict"):
+        print("Использование: python reviews.py import-legacy|variants|evict")
+        sys.exit(1)
+    from db import init_db
+    init_db()
+    if command == "import-legacy":
+        print(f"✅ Перенесено скриншотов: {import_legacy_reviews()}")
+    elif command == "variants":
+        if Image is None:
+            print("❌ Для превью нужен Pillow: pip install Pillow")
+            sys.exit(1)
+        try:
+            print(f"✅ Создано превью: {asyncio.run(_build_all_variants())}")
+        finally:
+            shutdown_image_pool()
+    else:
+        print(f"✅ Удалено оригиналов: {evict_originals()}")
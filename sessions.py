@@ -0,0 +1,213 @@
+import os
+import json
+import time
+from collections import OrderedDict
+
+from db import get_connection
+from flow import State, infer_state
+from repository import run_db
+
+# ================= SETTINGS =================
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(7 * 24 * 3600)))
+SESSION_MAX_IN_MEMORY = int(os.getenv("SESSION_MAX_IN_MEMORY", "10000"))
+SESSION_FLUSH_INTERVAL = int(os.getenv("SESSION_FLUSH_INTERVAL", "5"))
+
+# ================= SESSION =================
+class Session:
+    # Order-flow state of one buyer: the flow.State they are in and the
+    # answers collected so far (None for steps not reached yet)
+    FIELDS = (
+        "state",
+        "state_at",
+        "product_id",
+        "product_name",
+        "quantity",
+        "customer_name",
+        "order_number",
+        "order_id",
+        "payment_method",
+    )
+    __slots__ = ("user_id", "updated_at") + FIELDS
+
+    def __init__(self, user_id, updated_at=None, **fields):
+        self.user_id = user_id
+        self.updated_at = updated_at if updated_at is not None else time.time()
+        for name in self.FIELDS:
+            setattr(self, name, fields.get(name))
+        self.state = State(self.state) if self.state else State.IDLE
+
+    def is_empty(self):
+        return self.state is State.IDLE and all(
+            getattr(self, name) is None for name in self.FIELDS if name not in ("state", "state_at")
+        )
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.FIELDS if getattr(self, name) is not None}
+        data["state"] = self.state.value
+        return data
+
+    def dump(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, user_id, payload, updated_at):
+        fields = json.loads(payload)
+        if "state" not in fields:
+            fields["state"] = infer_state(fields).value
+        return cls(user_id, updated_at, **{k: v for k, v in fields.items() if k in cls.FIELDS})
+
+# ================= BACKENDS =================
+class NullSessionBackend:
+    # Memory only: sessions are lost on restart
+    def load(self, user_id):
+        return None
+
+    def save_many(self, rows):
+        pass
+
+    def delete_many(self, user_ids):
+        pass
+
+    def purge_expired(self, cutoff):
+        return 0
+
+class SqliteSessionBackend:
+    # Stores sessions in the sessions table of orders.db
+    def load(self, user_id):
+        with get_connection() as conn:
+            row = conn.execute(
+                "SELECT data, updated_at FROM sessions WHERE user_id=?", (user_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return Session.load(user_id, row[0], row[1])
+
+    def save_many(self, rows):
+        with get_connection() as conn:
+            conn.executemany("""
+                INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at
+            """, rows)
+
+    def delete_many(self, user_ids):
+        with get_connection() as conn:
+            conn.executemany("DELETE FROM sessions WHERE user_id=?", [(uid,) for uid in user_ids])
+
+    def purge_expired(self, cutoff):
+        with get_connection() as conn:
+            return conn.execute("DELETE FROM sessions WHERE updated_at < ?", (cutoff,)).rowcount
+
+BACKENDS = {
+    "sqlite": SqliteSessionBackend,
+    "memory": NullSessionBackend,
+}
+
+def make_backend(name=None):
+    name = name or os.getenv("SESSION_BACKEND", "sqlite")
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный SESSION_BACKEND: {name}")
+    return BACKENDS[name]()
+
+# ================= STORE =================
+class SessionStore:
+    # LRU cache of sessions with TTL eviction and write-behind persistence.
+    # Must only be used from the bot's event loop; backend calls run on the
+    # DB executor.
+    def __init__(self, backend=None, ttl=SESSION_TTL, max_in_memory=SESSION_MAX_IN_MEMORY):
+        self.backend = backend or NullSessionBackend()
+        self.ttl = ttl
+        self.max_in_memory = max_in_memory
+        self._sessions = OrderedDict()
+        # user_id -> Session (or None for a deleted session) waiting to be written
+        self._dirty = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expired(self, session, now):
+        return now - session.updated_at > self.ttl
+
+    async def get(self, user_id):
+        now = time.time()
+        session = self._sessions.get(user_id)
+        if session is None:
+            if user_id in self._dirty:
+                session = self._dirty[user_id]
+            else:
+                session = await run_db(self.backend.load, user_id)
+            # Another update for this user may have created it meanwhile
+            session = self._sessions.get(user_id) or session
+        if session is None or self._expired(session, now):
+            session = Session(user_id)
+
+        # Callers mutate the session in place, so every access marks it dirty
+        session.updated_at = now
+        self._remember(session)
+        return session
+
+    def mark_dirty(self, session):
+        # Call after mutating a session so the change is in the next flush.
+        # A session replaced by reset() meanwhile is stale and ignored.
+        current = self._sessions.get(session.user_id, self._dirty.get(session.user_id))
+        if current is not None and current is not session:
+            return
+        session.updated_at = time.time()
+        self._dirty[session.user_id] = session
+
+    async def reset(self, user_id):
+        session = Session(user_id)
+        self._remember(session)
+        return session
+
+    def _remember(self, session):
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        self._dirty[session.user_id] = session
+        while len(self._sessions) > self.max_in_memory:
+            # Dirty sessions stay in _dirty until the next flush
+            self._sessions.popitem(last=False)
+
+    def evict_expired(self):
+        now = time.time()
+        evicted = 0
+        # Least recently used first, so stop at the first live session
+        while self._sessions:
+            user_id, session = next(iter(self._sessions.items()))
+            if not self._expired(session, now):
+                break
+            del self._sessions[user_id]
+            self._dirty[user_id] = None
+            evicted += 1
+        return evicted
+
+    async def flush(self):
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, {}
+
+        rows, deleted = [], []
+        for user_id, session in dirty.items():
+            if session is None or session.is_empty():
+                deleted.append(user_id)
+            else:
+                rows.append((user_id, session.dump(), session.updated_at))
+
+        try:
+            await run_db(self._write, rows, deleted)
+        except Exception:
+            # Keep the batch for the next attempt unless it was touched again
+            for user_id, session in dirty.items():
+                self._dirty.setdefault(user_id, session)
+            raise
+        return len(dirty)
+
+    def _write(self, rows, deleted):
+        if rows:
+            self.backend.save_many(rows)
+        if deleted:
+            self.backend.delete_many(deleted)
+
+    async def maintain(self):
+        self.evict_expired()
+        await self.flush()
+        return await run_db(self.backend.purge_expired, time.time() - self.ttl)
@@ -0,0 +1,188 @@
+import os
+import json
+import queue
+import signal
+import asyncio
+import multiprocessing
+
+from telegram import Update
+from telegram.error import NetworkError, TimedOut
+
+from db import close_pool
+from webhook import (
+    WebhookApp, start_server, stop_on_signals, webhook_url,
+    WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS,
+)
+
+# ================= SETTINGS =================
+# Worker processes; 1 keeps the classic single-process bot
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))
+# Updates buffered per worker before the front stops accepting more
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+# How often workers reload stock sold by the other workers
+CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "10"))
+POLL_TIMEOUT = 10
+
+# Every process shares orders.db (WAL mode allows many readers and one
+# writer across processes): stock, orders and sessions are read and written
+# there, never kept only in a worker's memory. Sessions are cached per
+# worker, which is safe because a user always lands on the same worker.
+
+UPDATE_USER_FIELDS = (
+    "message", "edited_message", "callback_query", "inline_query",
+    "chosen_inline_result", "shipping_query", "pre_checkout_query",
+    "poll_answer", "my_chat_member", "chat_member", "chat_join_request",
+)
+
+def raw_user_id(data):
+    # User id of a raw update dict without building telegram objects
+    for field in UPDATE_USER_FIELDS:
+        part = data.get(field)
+        if part:
+            user = part.get("from") or part.get("user")
+            if user:
+                return user["id"]
+            chat = part.get("chat")
+            if chat:
+                return chat["id"]
+    return None
+
+def shard_for(user_id, shards):
+    return user_id % shards if user_id is not None else 0
+
+# ================= ROUTER =================
+class ShardRouter:
+    def __init__(self, queues):
+        self.queues = queues
+        self.routed = [0] * len(queues)
+
+    def route(self, data, block=True):
+        # Returns False when the worker's queue is full and block is False
+        shard = shard_for(raw_user_id(data), len(self.queues))
+        try:
+            self.queues[shard].put(json.dumps(data), block=block)
+        except queue.Full:
+            return False
+        self.routed[shard] += 1
+        return True
+
+    def backlog(self):
+        try:
+            return max(q.qsize() for q in self.queues)
+        except NotImplementedError:
+            # qsize() is not available on macOS
+            return 0
+
+class ShardedWebhookApp(WebhookApp):
+    # Same checks as WebhookApp, but hands raw updates to the router
+    def __init__(self, router, **kwargs):
+        super().__init__(None, **kwargs)
+        self.router = router
+
+    def backlog(self):
+        return self.router.backlog()
+
+    def accept(self, data):
+        return self.router.route(data, block=False)
+
+# ================= WORKER =================
+def _worker_main(build_app, shard, shards, updates):
+    # The front process handles Ctrl+C and tells workers to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app = build_app(shard=shard, shards=shards)
+    asyncio.run(_run_worker(app, shard, updates))
+
+async def _run_worker(app, shard, updates):
+    loop = asyncio.get_running_loop()
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    print(f"✅ Воркер {shard} запущен (pid {os.getpid()})")
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            await app.update_queue.put(Update.de_json(json.loads(raw), app.bot))
+    finally:
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+def start_workers(build_app, shards):
+    # Forked children must not inherit the parent's SQLite connections
+    close_pool()
+    context = multiprocessing.get_context("fork")
+    queues, processes = [], []
+    for shard in range(shards):
+        updates = context.Queue(maxsize=SHARD_QUEUE_SIZE)
+        process = context.Process(target=_worker_main, args=(build_app, shard, shards, updates), name=f"bot-shard-{shard}")
+        process.start()
+        queues.append(updates)
+        processes.append(process)
+    return queues, processes
+
+def stop_workers(queues, processes):
+    for updates in queues:
+        updates.put(None)
+    for process in processes:
+        process.join(timeout=30)
+        if process.is_alive():
+            process.terminate()
+
+# ================= FRONT =================
+async def _poll(bot, router, stop):
+    loop = asyncio.get_running_loop()
+    await bot.delete_webhook()
+    offset = None
+    while not stop.is_set():
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES)
+        except (NetworkError, TimedOut) as e:
+            print(f"Ошибка получения обновлений: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            # Blocks while the worker is full, which pauses polling
+            await loop.run_in_executor(None, router.route, update.to_dict())
+            offset = update.update_id + 1
+
+async def _serve_webhook(bot, router, stop):
+    await bot.set_webhook(
+        url=webhook_url(),
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    server = await start_server(ShardedWebhookApp(router))
+    print(f"✅ Webhook слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await stop.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+
+async def _run_front(bot, router, mode):
+    stop = stop_on_signals()
+    async with bot:
+        if mode == "webhook":
+            await _serve_webhook(bot, router, stop)
+            return
+        poller = asyncio.create_task(_poll(bot, router, stop))
+        await stop.wait()
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+
+def run_sharded(build_app, bot, mode="polling", shards=SHARD_WORKERS):
+    # The front process receives updates (polling or webhook) and routes each
+    # user to one worker process, so one user's updates stay in order while
+    # different users are handled on different cores.
+    queues, processes = start_workers(build_app, shards)
+    try:
+        asyncio.run(_run_front(bot, ShardRouter(queues), mode))
+    finally:
+        stop_workers(queues, processes)
@@ -0,0 +1,29 @@
+import sys
+import json
+
+from db import init_db, import_products, export_products, close_pool
+
+# Usage:
+#   python sync_products.py import [products.json]   - load catalog into orders.db
+#   python sync_products.py export [products.json]   - dump catalog from orders.db
+
+if len(sys.argv) < 2 or sys.argv[1] not in ("import", "export"):
+    print("Usage: python sync_products.py import|export [products.json]")
+    sys.exit(1)
+
+command = sys.argv[1]
+filename = sys.argv[2] if len(sys.argv) > 2 else "products.json"
+
+init_db()
+
+if command == "import":
+    with open(filename, "r", encoding="utf-8") as f:
+        count = import_products(json.load(f))
+    print(f"Imported {count} products from {filename}")
+else:
+    products = export_products()
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(products, f, ensure_ascii=False, indent=4)
+    print(f"Exported {len(products)} products to {filename}")
+
+close_pool()
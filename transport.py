@@ -0,0 +1,61 @@
+import os
+import socket
+import importlib.util
+
+import httpx
+from telegram.request import HTTPXRequest
+
+# ================= SETTINGS =================
+# Connections to the Bot API shared by handlers, broadcasts and background
+# workers. PTB's default of 256 mostly sits idle; pool_timeout is what a
+# call waits for a free connection before failing.
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "5"))
+# Idle connections are kept this long, so bursts skip the TCP/TLS handshake
+TELEGRAM_KEEPALIVE = float(os.getenv("TELEGRAM_KEEPALIVE", "60"))
+# HTTP/2 multiplexes all calls over one connection; needs `pip install h2`
+TELEGRAM_HTTP2 = os.getenv("TELEGRAM_HTTP2", "0") == "1"
+
+def _keepalive_socket_options():
+    # TCP keep-alive probes notice dead connections (e.g. after a NAT
+    # timeout on EC2) before a request is sent on them
+    options = [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    for name, value in (("TCP_KEEPIDLE", 30), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, name):
+            options.append((socket.IPPROTO_TCP, getattr(socket, name), value))
+    return options
+
+def http2_available():
+    return importlib.util.find_spec("h2") is not None
+
+# ================= REQUEST =================
+class TunedRequest(HTTPXRequest):
+    # HTTPXRequest with keep-alive limits, TCP keep-alive and optional
+    # HTTP/2. The transport is rebuilt with the client, so the request
+    # object survives Application shutdown/initialize cycles.
+    def __init__(self, pool_size=TELEGRAM_POOL_SIZE, http2=TELEGRAM_HTTP2, keepalive=TELEGRAM_KEEPALIVE, **kwargs):
+        if http2 and not http2_available():
+            print("⚠️ TELEGRAM_HTTP2=1, но пакет h2 не установлен, используется HTTP/1.1")
+            http2 = False
+        self._tuned = (pool_size, http2, keepalive)
+        kwargs.setdefault("pool_timeout", TELEGRAM_POOL_TIMEOUT)
+        super().__init__(connection_pool_size=pool_size, http_version="2" if http2 else "1.1", **kwargs)
+
+    def _build_client(self):
+        pool_size, http2, keepalive = self._tuned
+        self._client_kwargs["transport"] = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=keepalive,
+            ),
+            http1=True,
+            http2=http2,
+            socket_options=_keepalive_socket_options(),
+        )
+        return super()._build_client()
+
+def make_requests():
+    # (request for API calls, request for getUpdates). The long poll gets
+    # its own single connection so it never waits behind other calls.
+    return TunedRequest(), TunedRequest(pool_size=1, http2=False)
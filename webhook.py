@@ -0,0 +1,228 @@
+import os
+import hmac
+import json
+import signal
+import asyncio
+import secrets
+from http import HTTPStatus
+
+from telegram import Update
+
+# ================= SETTINGS =================
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Telegram sends it back in every webhook call. Without one a random secret
+# is made per start; set it explicitly when several instances share a URL.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "") or secrets.token_urlsafe(32)
+# Updates queued or in progress before we answer 503 and let Telegram
+# redeliver later
+WEBHOOK_MAX_QUEUE = int(os.getenv("WEBHOOK_MAX_QUEUE", "1000"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+MAX_BODY_SIZE = 1024 * 1024
+
+SECRET_HEADER = b"x-telegram-bot-api-secret-token"
+
+# ================= ASGI APP =================
+class WebhookApp:
+    # ASGI application that validates Telegram webhook calls and feeds the
+    # updates into a PTB Application. Works with the built-in server below
+    # or any ASGI server (uvicorn, hypercorn, ...).
+    def __init__(self, application, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET, max_queue=WEBHOOK_MAX_QUEUE):
+        if not secret:
+            # The endpoint is public; without a secret anyone could post updates
+            raise ValueError("Нужен секрет вебхука (WEBHOOK_SECRET).")
+        self.application = application
+        self.path = path
+        self.secret = secret.encode()
+        self.max_queue = max_queue
+        self.received = 0
+        self.rejected = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        status, body = await self._handle(scope, receive)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _handle(self, scope, receive):
+        if scope["path"] != self.path:
+            return 404, b"not found"
+        if scope["method"] != "POST":
+            return 405, b"method not allowed"
+
+        headers = dict(scope["headers"])
+        if not hmac.compare_digest(headers.get(SECRET_HEADER, b""), self.secret):
+            self.rejected += 1
+            return 403, b"forbidden"
+
+        if self.backlog() >= self.max_queue:
+            # Telegram retries failed deliveries, so shed load instead of queueing forever
+            return 503, b"busy"
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > MAX_BODY_SIZE:
+                return 413, b"too large"
+            if not message.get("more_body"):
+                break
+
+        try:
+            accepted = self.accept(json.loads(body))
+        except (ValueError, TypeError, KeyError):
+            return 400, b"bad request"
+        if not accepted:
+            return 503, b"busy"
+
+        self.received += 1
+        return 200, b"ok"
+
+    def backlog(self):
+        # With concurrent processing updates leave the queue at once, so count
+        # the ones the update processor is still working on as well
+        pending = getattr(self.application.update_processor, "pending", 0)
+        return self.application.update_queue.qsize() + pending
+
+    def accept(self, data):
+        self.application.update_queue.put_nowait(Update.de_json(data, self.application.bot))
+        return True
+
+# ================= BUILT-IN SERVER =================
+# A small HTTP/1.1 server for ASGI apps, so webhook mode needs no extra
+# dependencies. It supports keep-alive and Content-Length bodies, which is
+# all Telegram (and a reverse proxy in front of the bot) uses.
+async def _serve_connection(app, reader, writer):
+    peer = writer.get_extra_info("peername")
+    server = writer.get_extra_info("sockname")
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, version = request_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+
+            headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers.append((name.strip().lower().encode("latin-1"), value.strip().encode("latin-1")))
+            header_map = dict(headers)
+
+            length = int(header_map.get(b"content-length", b"0"))
+            if length > MAX_BODY_SIZE:
+                writer.write(b"HTTP/1.1 413 Payload Too Large\r\ncontent-length: 0\r\nconnection: close\r\n\r\n")
+                await writer.drain()
+                break
+            body = await reader.readexactly(length) if length else b""
+
+            path, _, query = target.partition("?")
+            scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": version.partition("/")[2] or "1.1",
+                "method": method.upper(),
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode("latin-1"),
+                "query_string": query.encode("latin-1"),
+                "headers": headers,
+                "client": peer[:2] if peer else None,
+                "server": server[:2] if server else None,
+            }
+
+            request = [{"type": "http.request", "body": body, "more_body": False}]
+            async def receive():
+                return request.pop() if request else {"type": "http.disconnect"}
+
+            response = {"status": 500, "headers": [], "body": b""}
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    response["status"] = message["status"]
+                    response["headers"] = message.get("headers", [])
+                elif message["type"] == "http.response.body":
+                    response["body"] += message.get("body", b"")
+
+            try:
+                await app(scope, receive, send)
+            except Exception as e:
+                print(f"Ошибка обработки запроса {path}: {e}")
+                response = {"status": 500, "headers": [], "body": b""}
+
+            keep_alive = version == "HTTP/1.1" and header_map.get(b"connection", b"").lower() != b"close"
+            status = HTTPStatus(response["status"])
+            out_headers = [(k, v) for k, v in response["headers"] if k.lower() not in (b"content-length", b"connection")]
+            out_headers.append((b"content-length", str(len(response["body"])).encode()))
+            out_headers.append((b"connection", b"keep-alive" if keep_alive else b"close"))
+
+            head = f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode("latin-1")
+            head += b"".join(k + b": " + v + b"\r\n" for k, v in out_headers)
+            writer.write(head + b"\r\n" + response["body"])
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    except asyncio.CancelledError:
+        # Idle keep-alive connections are cancelled when the loop shuts down
+        pass
+    finally:
+        writer.close()
+
+async def start_server(app, host=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+    return await asyncio.start_server(lambda r, w: _serve_connection(app, r, w), host, port)
+
+# ================= RUN =================
+def stop_on_signals():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    return stop
+
+def webhook_url():
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не задан.")
+    return WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+
+async def run_webhook(application, allowed_updates=Update.ALL_TYPES):
+    # Webhook counterpart of Application.run_polling()
+    url = webhook_url()
+    stop = stop_on_signals()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=allowed_updates,
+        )
+        await application.start()
+        server = await start_server(WebhookApp(application))
+        print(f"✅ Webhook слушает {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        try:
+            await stop.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    finally:
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)